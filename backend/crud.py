@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, text
 from datetime import datetime
 from backend import models, schemas
 from web_parsing.product import Product
@@ -64,13 +64,28 @@ def create_parsed_product(db: Session, product_id: int, price: float, etl_date:
     pp = models.ParsedProduct(
         product_id=product_id,
         price_proceeded=price,
-        etl_date=etl_date
+        etl_date=etl_date,
+        last_seen_at=etl_date
     )
     db.add(pp)
     db.commit()
     db.refresh(pp)
     return pp
 
+def get_price_observations(db: Session, product_id: int, start_date: datetime = None):
+    """Observed prices of a product in time order, read from the price_observations view"""
+    sql = """
+        SELECT etl_date, price_proceeded
+        FROM price_observations
+        WHERE product_id = :product_id
+    """
+    params = {"product_id": product_id}
+    if start_date:
+        sql += " AND etl_date >= :start_date"
+        params["start_date"] = start_date
+    sql += " ORDER BY etl_date"
+    return db.execute(text(sql), params).all()
+
 def get_subscribed_products(db: Session, user_id: int):
     return (
         db.query(models.Product)
@@ -168,12 +183,15 @@ def get_detailed_product_response_by_id(db: Session, product_id: int):
         .order_by(models.ParsedProduct.etl_date.desc())\
         .first()
 
-    # Get the previous price
-    prev_price = db.query(models.ParsedProduct)\
-        .filter(models.ParsedProduct.product_id == product_id)\
-        .order_by(models.ParsedProduct.etl_date.desc())\
-        .offset(1)\
-        .first()
+    # Get the previous price, a latest row seen more than once was also the previous observation
+    if latest_price and latest_price.last_seen_at and latest_price.last_seen_at > latest_price.etl_date:
+        prev_price = latest_price
+    else:
+        prev_price = db.query(models.ParsedProduct)\
+            .filter(models.ParsedProduct.product_id == product_id)\
+            .order_by(models.ParsedProduct.etl_date.desc())\
+            .offset(1)\
+            .first()
 
     # Get the latest price prediction
     latest_prediction = db.query(models.ProductPricePrediction)\
@@ -2,6 +2,7 @@ from typing import List, Optional
 from datetime import timedelta
 import logging
 import sys
+import threading
 
 from fastapi import FastAPI, Depends, HTTPException, status, Response, Cookie, Query, APIRouter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -13,9 +14,11 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from web_parsing.configuration_loader import ConfigurationLoader
 from web_parsing.marketplace_parser import MarketplaceParser
+from web_parsing.model_store import get_product_model, to_datetimes
 from datetime import datetime
 
 from backend import crud, models, schemas, auth, database
+from backend.prediction_cache import ModelCache
 
 # Configure logging to output to stdout
 logging.basicConfig(
@@ -68,6 +71,36 @@ def admin_required(current_user: models.User = Depends(get_current_user)):
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Admin privileges required")
     return current_user
 
+_parser = None
+_parser_config = None
+_parser_lock = threading.Lock()
+_configuration_loader = None
+
+def get_configuration_loader() -> ConfigurationLoader:
+    """Loader created once, on the process-wide engine of web_parsing.db"""
+    global _configuration_loader
+    with _parser_lock:
+        if _configuration_loader is None:
+            _configuration_loader = ConfigurationLoader(
+                None,
+                "web_parsing/configuration/config_new.json",
+                "web_parsing/configuration/required_fields_new.json"
+            )
+        return _configuration_loader
+
+def get_marketplace_parser() -> MarketplaceParser:
+    """Return a parser for the current configuration, keeping its HTTP sessions between requests"""
+    global _parser, _parser_config
+    # Read on every request, so configuration changes still replace the parser
+    config = get_configuration_loader().get_configuration_object()
+    with _parser_lock:
+        if _parser is None or config != _parser_config:
+            if _parser is not None:
+                _parser.close()
+            _parser = MarketplaceParser(config)
+            _parser_config = config
+        return _parser
+
 
 @api_router.post("/register/", response_model=schemas.UserResponse)
 def register_user(
@@ -188,14 +221,10 @@ def product_by_url(
     # live parse
     try:
         logger.debug("Product not found in database, attempting live parse")
-        config = ConfigurationLoader(
-            database.DATABASE_URL,
-            "web_parsing/configuration/config_new.json",
-            "web_parsing/configuration/required_fields_new.json"
-        ).get_configuration_object()
-        logger.debug("Configuration loaded successfully")
-        
-        parser = MarketplaceParser(config)
+        parser = get_marketplace_parser()
+        # Reject unsupported marketplaces before any request leaves the server
+        if parser.router.resolve(req.url) is None:
+            raise Exception(f"Couldn't find configuration for the following url: {req.url}")
         logger.debug("Parser initialized, starting product parsing")
         parsed = parser.parse_product_by_url(req.url)
         logger.debug(f"Product parsed successfully: {parsed.__dict__}")
@@ -241,6 +270,34 @@ def product_by_id(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return pr
 
+MAX_DAYS_AHEAD = 365
+model_cache = ModelCache()
+
+@api_router.get(
+    "/products/{product_id}/prediction",
+    response_model=schemas.PricePrediction
+)
+def product_prediction(
+    product_id: int,
+    days_ahead: int = Query(30, ge=1, le=MAX_DAYS_AHEAD, description="Days past the last price observation"),
+    db: Session = Depends(database.get_db)
+):
+    # Hot products are answered from the cached model without touching the database,
+    # a product without a stored model yet is fitted in memory, never stored
+    product_models = model_cache.get(product_id, get_product_model)
+    if not len(product_models):
+        if not crud.get_product_by_id(db, product_id):
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Product not found")
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Not enough price history to predict this product")
+    predicted, change = product_models.predict(days_ahead)
+    return {
+        "product_id": product_id,
+        "days_ahead": days_ahead,
+        "predicted_date": to_datetimes(product_models.last_dates)[0] + timedelta(days=days_ahead),
+        "predicted_price": round(float(predicted[0]), 1),
+        "change_index": round(float(change[0]), 2)
+    }
+
 @api_router.get(
     "/products/",
     response_model=List[schemas.BasicProduct]
@@ -342,11 +399,8 @@ def get_price_history(product_id: int, period: str = "1m", db: Session = Depends
     else:
         start_date = now - timedelta(days=30)
 
-    query = db.query(models.ParsedProduct).filter(models.ParsedProduct.product_id == product_id)
-    if start_date:
-        query = query.filter(models.ParsedProduct.etl_date >= start_date)
-    query = query.order_by(models.ParsedProduct.etl_date)
-    results = query.all()
+    # Prices are stored as ranges of unchanged observations, the view gives the first and last crawl of each
+    results = crud.get_price_observations(db, product_id, start_date)
 
     # Group by date (YYYY-MM-DD)
     grouped = defaultdict(list)
@@ -522,4 +576,10 @@ def get_marketplace_configs_short(db: Session = Depends(database.get_db)):
         })
     return result
 
+@app.on_event("shutdown")
+def close_marketplace_parser():
+    with _parser_lock:
+        if _parser is not None:
+            _parser.close()
+
 app.include_router(api_router)
\ No newline at end of file
@@ -24,14 +24,17 @@ class ParsedProduct(Base):
     product_id       = Column(Integer, ForeignKey('products.id'))
     price_proceeded  = Column(Numeric)
     etl_date         = Column(DateTime)
+    last_seen_at     = Column(DateTime)
 
 class ProductPricePrediction(Base):
     __tablename__ = 'product_price_predictions'
-    id               = Column(Integer, primary_key=True, index=True)
-    product_id       = Column(Integer, ForeignKey('products.id'))
-    predicted_price  = Column(Numeric)
-    change_index     = Column(Numeric)
-    etl_date         = Column(DateTime)
+    id                   = Column(Integer, primary_key=True, index=True)
+    product_id           = Column(Integer, ForeignKey('products.id'))
+    predicted_price      = Column(Numeric)
+    change_index         = Column(Numeric)
+    etl_date             = Column(DateTime)
+    history_last_seen_at = Column(DateTime)
+    history_last_price   = Column(Numeric)
 
 class UserProductSubscription(Base):
     __tablename__ = 'users_products_subscriptions'
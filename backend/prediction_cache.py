@@ -0,0 +1,34 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 10000
+# Models are refitted every prediction run, a cached one is at most this old
+DEFAULT_CACHE_TTL_SECONDS = 300
+
+class ModelCache:
+    """In-process LRU of the stored models of hot products, entries expire after ``ttl`` seconds"""
+
+    def __init__(self, size=None, ttl=None):
+        self.size = size if size is not None else int(os.getenv('PREDICTION_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        self.ttl = ttl if ttl is not None else float(os.getenv('PREDICTION_CACHE_TTL_SECONDS', DEFAULT_CACHE_TTL_SECONDS))
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, product_id, load):
+        """Cached model of ``product_id``, ``load(product_id)`` fills a missing or expired entry"""
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__entries.get(product_id)
+            if entry is not None and entry[0] > now:
+                self.__entries.move_to_end(product_id)
+                return entry[1]
+        # Loaded outside the lock, a slow load doesn't hold up requests for other products
+        model = load(product_id)
+        with self.__lock:
+            self.__entries[product_id] = (now + self.ttl, model)
+            self.__entries.move_to_end(product_id)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+        return model
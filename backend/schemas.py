@@ -1,5 +1,6 @@
 from pydantic import BaseModel, ConfigDict, RootModel
 from typing import Optional
+from datetime import datetime
 
 class UserCreate(BaseModel):
     username: str
@@ -66,6 +67,13 @@ class DetailedProduct(BasicProduct):
 
     model_config = ConfigDict(from_attributes=True)
 
+class PricePrediction(BaseModel):
+    product_id:      int
+    days_ahead:      int
+    predicted_date:  datetime
+    predicted_price: float
+    change_index:    float
+
 class MarketplaceField(BaseModel):
     name: str
     html_div_class: str
@@ -78,6 +86,9 @@ class MarketplaceConfig(BaseModel):
     name: str
     fields: list[MarketplaceField]
     marketplace_url: list[str] | str
+    extraction_backend: Optional[str] = None
+    structured_data: Optional[bool] = None
+    price_locale: Optional[dict] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -90,5 +101,8 @@ class MarketplaceConfigUpdate(BaseModel):
     name: str
     fields: list[MarketplaceField]
     marketplace_url: list[str] | str
+    extraction_backend: Optional[str] = None
+    structured_data: Optional[bool] = None
+    price_locale: Optional[dict] = None
 
     model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
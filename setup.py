@@ -7,10 +7,15 @@ setup(
     install_requires=[
         "requests",
         "beautifulsoup4",
+        "soupsieve",
         "pandas",
         "scikit-learn",
         "schedule",
         "psycopg2-binary",
-        "sqlalchemy"
+        "sqlalchemy",
+        "aiohttp"
     ],
+    package_data={
+        "web_parsing": ["migrations/*.sql"],
+    },
 ) 
\ No newline at end of file
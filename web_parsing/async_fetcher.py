@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import os
+from .page_cache import hash_content
+from .utils import fingerprint_configuration
+from .extraction_pool import extract_page, get_extraction_workers
+from .rate_limiter import AdaptiveRateLimiter, RetryPolicy, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_MARKETPLACE_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_STREAM_MAX_BYTES = 5 * 1024 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+
+def parse_marketplace_limits(raw_limits, value_type=int):
+    """Parse limits written as 'rozetka=8,touch=4' into a dict"""
+    limits = dict()
+    if not raw_limits:
+        return limits
+    for item in raw_limits.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, value = item.partition('=')
+        if not value:
+            raise Exception(f"Invalid marketplace concurrency limit: '{item}', expected 'key=number'.")
+        limits[key.strip()] = value_type(value)
+    return limits
+
+class DownloadedPage:
+    def __init__(self, content, encoding, etag, last_modified, content_hash):
+        self.content = content
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+
+class DownloadSlot:
+    """The marketplace and the global concurrency slot of one download.
+
+    ``release`` gives back only what is held, so the slot can be let go
+    during a retry backoff and the ``async with`` exit stays correct even if
+    the download is cancelled while acquiring it again.
+    """
+
+    def __init__(self, *semaphores):
+        self.semaphores = semaphores
+        self.held = 0
+
+    async def acquire(self):
+        for semaphore in self.semaphores[self.held:]:
+            await semaphore.acquire()
+            self.held += 1
+
+    def release(self):
+        while self.held:
+            self.held -= 1
+            self.semaphores[self.held].release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.release()
+
+class AsyncFetcher:
+    """Downloads product pages concurrently and hands them to the parser.
+
+    At most ``concurrency`` pages download at once, additionally limited
+    for every marketplace key by ``marketplace_concurrency`` (or by the
+    marketplace specific value from ``marketplace_limits``). Every
+    marketplace has its own queue and fetcher tasks, so a marketplace at its
+    limit never holds up the pages of the others. Downloaded pages
+    go through a queue of at most ``queue_size`` pages to the extraction
+    stage. When the queue is full the fetchers wait, so downloads never run
+    ahead of extraction by more than the queue size.
+
+    Extraction runs on ``executor`` (see ``extraction_pool``) when one is
+    given, otherwise in this process between downloads.
+
+    With a ``page_cache`` the requests are conditional, and pages answered
+    with 304 or with an unchanged body reuse the previously extracted values.
+
+    Every request takes a token from the marketplace bucket of
+    ``rate_limiter``. Throttled (429/503), gateway and network errors are
+    retried according to ``retry_policy`` instead of dropping the product.
+
+    Bodies are streamed in fixed size chunks. With ``stream_cutoff`` the
+    download stops as soon as the container of every configured field has
+    been read, and no body is ever read past ``max_body_bytes``. The page
+    prefix read so far is what gets extracted and cached.
+    """
+
+    def __init__(self, parser, concurrency=None, marketplace_concurrency=None, marketplace_limits=None, timeout=None, page_cache=None, executor=None, extraction_workers=None, queue_size=None, rate_limiter=None, retry_policy=None, stream_cutoff=None, max_body_bytes=None):
+        self.parser = parser
+        self.page_cache = page_cache
+        self.executor = executor
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(
+            marketplace_rates=parse_marketplace_limits(os.getenv('CRAWL_MARKETPLACE_RATES'), float)
+        )
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.__config_fingerprints = dict()
+        self.concurrency = concurrency or int(os.getenv('CRAWL_CONCURRENCY', DEFAULT_CONCURRENCY))
+        self.marketplace_concurrency = marketplace_concurrency or int(
+            os.getenv('CRAWL_MARKETPLACE_CONCURRENCY', DEFAULT_MARKETPLACE_CONCURRENCY)
+        )
+        if marketplace_limits is None:
+            marketplace_limits = parse_marketplace_limits(os.getenv('CRAWL_MARKETPLACE_LIMITS'))
+        self.marketplace_limits = marketplace_limits
+        self.timeout = timeout or int(os.getenv('CRAWL_TIMEOUT', DEFAULT_TIMEOUT))
+        self.queue_size = queue_size or int(os.getenv('CRAWL_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        if stream_cutoff is None:
+            stream_cutoff = os.getenv('CRAWL_STREAM_CUTOFF', 'true').lower() not in ('0', 'false', 'no')
+        self.stream_cutoff = stream_cutoff
+        self.max_body_bytes = max_body_bytes or int(os.getenv('CRAWL_STREAM_MAX_BYTES', DEFAULT_STREAM_MAX_BYTES))
+        # One extractor task per worker process keeps every worker busy
+        # without queueing pages inside the executor, past the backpressure.
+        if executor is not None:
+            self.extractors = extraction_workers or get_extraction_workers()
+        else:
+            self.extractors = 1
+
+    def fetch_all(self, parsing_objects):
+        """Fetch and parse every object, returns a list of (object, product or exception) pairs in input order"""
+        return asyncio.run(self.__fetch_all(parsing_objects))
+
+    async def __fetch_all(self, parsing_objects):
+        results = [None] * len(parsing_objects)
+        pending = dict()
+        for index, parsing_object in enumerate(parsing_objects):
+            # Keyed on the configuration serving the URL, like the synchronous
+            # path, a stored marketplace key may be stale
+            try:
+                _, key = self.parser.find_configuration_by_url(parsing_object.url)
+            except Exception as e:
+                results[index] = (parsing_object, e)
+                continue
+            if key not in pending:
+                pending[key] = asyncio.Queue()
+            pending[key].put_nowait((index, parsing_object))
+        pages = asyncio.Queue(maxsize=self.queue_size)
+        download_slots = asyncio.Semaphore(self.concurrency)
+
+        # Pages of one marketplace share a session, so connections to the
+        # same host are reused for the whole batch.
+        sessions = self.parser.sessions
+        fetchers = list()
+        for key, queue in pending.items():
+            marketplace_semaphore = asyncio.Semaphore(self.marketplace_limits.get(key, self.marketplace_concurrency))
+            fetchers.extend(
+                asyncio.create_task(self.__run_fetcher(key, queue, pages, results, marketplace_semaphore, download_slots))
+                for _ in range(min(self.concurrency, queue.qsize()))
+            )
+        extractors = [
+            asyncio.create_task(self.__run_extractor(pages, results))
+            for _ in range(self.extractors)
+        ]
+        try:
+            await asyncio.gather(*fetchers)
+            await pages.join()
+        finally:
+            for task in fetchers + extractors:
+                task.cancel()
+            await asyncio.gather(*fetchers, *extractors, return_exceptions=True)
+            await sessions.close_async()
+            if self.page_cache is not None:
+                self.page_cache.flush()
+        return results
+
+    async def __run_fetcher(self, key, pending, pages, results, marketplace_semaphore, download_slots):
+        """Downloads the pages of one marketplace, a download takes a marketplace slot first and then a global one"""
+        session = self.parser.sessions.get_async_session(key, self.timeout)
+        while True:
+            try:
+                index, parsing_object = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            async with DownloadSlot(marketplace_semaphore, download_slots) as slot:
+                try:
+                    result = await self.__download(session, parsing_object, key, slot)
+                except Exception as e:
+                    result = e
+            if isinstance(result, DownloadedPage):
+                await pages.put((index, parsing_object, key, result))
+            else:
+                results[index] = (parsing_object, result)
+
+    async def __run_extractor(self, pages, results):
+        loop = asyncio.get_running_loop()
+        while True:
+            index, parsing_object, key, page = await pages.get()
+            url = parsing_object.url
+            try:
+                if self.executor is not None:
+                    product = await loop.run_in_executor(self.executor, extract_page, url, page.content, page.encoding)
+                else:
+                    product = self.parser.parse_product_from_html(page.content, url, page.encoding)
+                if self.page_cache is not None:
+                    self.page_cache.put(url, page.etag, page.last_modified, page.content_hash, self.__get_config_fingerprint(key), product)
+                results[index] = (parsing_object, product)
+            except Exception as e:
+                results[index] = (parsing_object, e)
+            finally:
+                pages.task_done()
+
+    async def __download(self, session, parsing_object, key, slot):
+        """Returns a DownloadedPage, a cached product or the exception that stopped the download.
+
+        ``key`` is the marketplace serving the URL. ``slot`` is held while a
+        request runs and let go during the retry backoff.
+        """
+        url = parsing_object.url
+        cached_page = None
+        request_headers = None
+        if self.page_cache is not None:
+            cached_page = self.page_cache.get(url)
+            if cached_page is not None and cached_page.config_fingerprint == self.__get_config_fingerprint(key):
+                request_headers = cached_page.get_conditional_headers()
+            else:
+                cached_page = None
+
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(key)
+            retry_after = None
+            try:
+                async with session.get(url, headers=request_headers) as response:
+                    if self.retry_policy.is_retryable(response.status):
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        if response.status in (429, 503):
+                            self.rate_limiter.record_throttled(key, retry_after)
+                        raise Exception(f"Response code was: {response.status}, couldn't parse url: {url}")
+                    self.rate_limiter.record_success(key)
+                    if response.status == 304 and cached_page is not None:
+                        self.page_cache.touch(url, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                        return cached_page.to_product()
+                    if response.status != 200:
+                        return Exception(f"Response code was: {response.status}, couldn't parse url: {url}")
+                    encoding = response.charset
+                    content = await self.__read_body(response, key, encoding)
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+                    break
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries:
+                    logger.error("Failed to fetch %s after %s attempt(s): %s", url, attempt + 1, e)
+                    return e
+                delay = self.retry_policy.get_delay(attempt, retry_after)
+                logger.warning("Retrying %s in %.1fs: %s", url, delay, e)
+                attempt += 1
+                # Other pages of the marketplace may use the slot meanwhile, the rate limiter still spaces them
+                slot.release()
+                await asyncio.sleep(delay)
+                await slot.acquire()
+
+        content_hash = None
+        if self.page_cache is not None:
+            content_hash = hash_content(content)
+            if cached_page is not None and cached_page.content_hash == content_hash:
+                self.page_cache.touch(url, etag, last_modified)
+                return cached_page.to_product()
+        return DownloadedPage(content, encoding, etag, last_modified, content_hash)
+
+    async def __read_body(self, response, key, encoding):
+        """Page bytes up to the point where every field is located, or up to ``max_body_bytes``"""
+        locator = None
+        extraction_plan = self.parser.extraction_plans[key]
+        # Page metadata may come after the field containers, structured data pages are read in full
+        if self.stream_cutoff and not extraction_plan.structured_data:
+            locator = extraction_plan.create_locator(encoding)
+        body = bytearray()
+        while len(body) < self.max_body_bytes:
+            # Fixed size chunks make the cut-off point, and so the content hash, independent of the network
+            try:
+                chunk = await response.content.readexactly(min(STREAM_CHUNK_SIZE, self.max_body_bytes - len(body)))
+                finished = False
+            except asyncio.IncompleteReadError as e:
+                chunk = e.partial
+                finished = True
+            body += chunk
+            if finished:
+                return bytes(body)
+            if locator is not None and locator.feed(chunk):
+                logger.debug("Located every field of %s after %s bytes", response.url, len(body))
+                return bytes(body)
+        if not response.content.at_eof():
+            logger.warning("Body of %s was cut at %s bytes", response.url, self.max_body_bytes)
+        return bytes(body)
+
+    def __get_config_fingerprint(self, key):
+        fingerprint = self.__config_fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = fingerprint_configuration(self.parser.configuration_object[key])
+            self.__config_fingerprints[key] = fingerprint
+        return fingerprint
@@ -0,0 +1,229 @@
+import numpy as np
+
+RIDGE_ALPHA = 1.0
+# batch_main skips shorter histories
+MIN_HISTORY = 5
+# TimeSeriesSplit(n_splits=3) needs at least 4 training rows
+MIN_TRAINING_ROWS = 4
+OUTLIER_SIGMAS = 3
+MOVING_AVERAGE_WINDOW = 7
+NANOSECONDS_PER_DAY = 86400 * 10**9
+# 1970-01-01 was a Thursday, day 3 counting from Monday
+EPOCH_DAY_OF_WEEK = 3
+# Observations are resampled onto this grid (in ns), the 6 hour crawl cadence lag1 and ma7 were designed on
+RESAMPLE_INTERVAL = 6 * 3600 * 10**9
+# datetime64 NaT as int64, a grid without a previous point
+NO_DATE = np.iinfo(np.int64).min
+
+class PriceHistories:
+    """Price histories of many products as flat arrays.
+
+    ``dates`` (datetime64[ns]) and ``prices`` hold every observation in
+    product and time order, the rows of ``product_ids[i]`` are
+    ``starts[i]:ends[i]``.
+    """
+
+    def __init__(self, product_ids, dates, prices, starts, ends):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.prices = np.asarray(prices, dtype=float)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def select(self, positions):
+        """Histories of the products at ``positions`` only, the arrays are shared"""
+        return PriceHistories(self.product_ids[positions], self.dates, self.prices, self.starts[positions], self.ends[positions])
+
+    def to_padded(self):
+        """(dates in ns, prices, lengths) as [products, longest history] matrices padded with NaN prices"""
+        lengths = self.ends - self.starts
+        width = int(lengths.max()) if len(lengths) else 0
+        columns = np.arange(width)
+        inside = columns < lengths[:, None]
+        positions = np.where(inside, self.starts[:, None] + columns, 0)
+        dates = np.where(inside, self.dates.view(np.int64)[positions] if len(self.dates) else 0, 0)
+        prices = np.where(inside, self.prices[positions] if len(self.prices) else np.nan, np.nan)
+        return dates, prices, lengths
+
+def resample_histories(histories, after=None, carried_prices=None):
+    """Prices in effect at every multiple of RESAMPLE_INTERVAL since the epoch, as PriceHistories.
+
+    Observations are steps, a price holds until the next observation. The
+    grid runs from the first observation to the last one of every product.
+    With ``after`` (one grid point or NO_DATE per product) it continues
+    right after that point instead, and grid points before the first
+    observation get the ``carried_prices`` in effect at ``after``.
+    Products without a grid point are left out.
+    """
+    count = len(histories)
+    if after is None:
+        after = np.full(count, NO_DATE)
+        carried_prices = np.full(count, np.nan)
+    lengths = histories.ends - histories.starts
+    observation_products = np.repeat(np.arange(count), lengths)
+    observation_rows = np.repeat(histories.starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(int(lengths.sum()))
+    observation_dates = histories.dates.view(np.int64)[observation_rows]
+
+    first_dates = -(-histories.dates.view(np.int64)[histories.starts] // RESAMPLE_INTERVAL) * RESAMPLE_INTERVAL
+    grid_starts = np.where(after == NO_DATE, first_dates, after + RESAMPLE_INTERVAL)
+    grid_ends = histories.dates.view(np.int64)[histories.ends - 1] // RESAMPLE_INTERVAL * RESAMPLE_INTERVAL
+    counts = np.maximum((grid_ends - grid_starts) // RESAMPLE_INTERVAL + 1, 0)
+    grid_products = np.repeat(np.arange(count), counts)
+    grid_dates = grid_starts[grid_products] + (np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)) * RESAMPLE_INTERVAL
+
+    # Grid points sort after the observations of their product up to their date, equal dates included
+    products = np.concatenate([observation_products, grid_products])
+    dates = np.concatenate([observation_dates, grid_dates])
+    is_grid = np.concatenate([np.zeros(len(observation_rows), dtype=bool), np.ones(len(grid_dates), dtype=bool)])
+    order = np.lexsort((is_grid, dates, products))
+    latest = np.maximum.accumulate(np.where(is_grid[order], -1, np.arange(len(order))))[is_grid[order]]
+    sources = order[np.maximum(latest, 0)]
+    observed = (latest >= 0) & (products[sources] == grid_products)
+    prices = np.where(
+        observed,
+        histories.prices[observation_rows[np.where(observed, sources, 0)]] if len(observation_rows) else np.nan,
+        carried_prices[grid_products]
+    )
+    present = counts > 0
+    ends = np.cumsum(counts[present])
+    return PriceHistories(histories.product_ids[present], grid_dates.view('datetime64[ns]'), prices, ends - counts[present], ends)
+
+def compact_rows(dates, prices, keep):
+    """Move the kept observations of every row to its start, returns (dates, prices, lengths)"""
+    order = np.argsort(~keep, axis=1, kind='stable')
+    dates = np.take_along_axis(dates, order, axis=1)
+    prices = np.take_along_axis(prices, order, axis=1)
+    lengths = keep.sum(axis=1)
+    inside = np.arange(prices.shape[1]) < lengths[:, None]
+    return np.where(inside, dates, 0), np.where(inside, prices, np.nan), lengths
+
+def remove_outliers(dates, prices, lengths, sigmas=OUTLIER_SIGMAS):
+    """``preprocess`` for every row: drop missing prices and prices further than ``sigmas`` sigma from the mean"""
+    dates, prices, lengths = compact_rows(dates, prices, ~np.isnan(prices))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(prices, axis=1) / lengths
+        sigma = np.sqrt(np.nansum((prices - mean[:, None]) ** 2, axis=1) / (lengths - 1))
+        keep = (prices >= (mean - sigmas * sigma)[:, None]) & (prices <= (mean + sigmas * sigma)[:, None])
+    return compact_rows(dates, prices, keep)
+
+def get_days(dates):
+    """Whole days since the epoch of nanosecond timestamps"""
+    return np.floor_divide(dates, NANOSECONDS_PER_DAY)
+
+def build_features(dates, prices, lengths, origins=None, first_rows=None):
+    """``engineer_features`` for every row, returns (X [products, rows, 4], y, mask of real rows).
+
+    ``t`` counts days from ``origins`` (the first date of every row by
+    default). Only columns from ``first_rows`` on are in the mask, row 0 of
+    every product has no lag and is masked out like dropna does.
+    """
+    width = prices.shape[1]
+    columns = np.arange(width)
+    inside = columns < lengths[:, None]
+    if origins is None:
+        origins = dates[:, 0]
+    if first_rows is None:
+        first_rows = np.ones(len(prices), dtype=np.int64)
+    filled = np.where(inside, prices, 0.0)
+    cumulative = np.concatenate([np.zeros((len(prices), 1)), np.cumsum(filled, axis=1)], axis=1)
+    window_start = np.maximum(columns - MOVING_AVERAGE_WINDOW + 1, 0)
+    moving_average = (cumulative[:, columns + 1] - cumulative[:, window_start]) / (columns + 1 - window_start)
+    # Row 0 gets a placeholder lag, it is masked out of the fit anyway
+    lag = np.concatenate([np.zeros((len(prices), 1)), prices[:, :-1]], axis=1)
+    X = np.stack([
+        (dates - origins[:, None]) // NANOSECONDS_PER_DAY,
+        (get_days(dates) + EPOCH_DAY_OF_WEEK) % 7,
+        np.where(inside, lag, 0.0),
+        np.where(inside, moving_average, 0.0)
+    ], axis=2).astype(float)
+    mask = inside & (columns >= np.maximum(first_rows, 1)[:, None])
+    return X, np.where(mask, prices, 0.0), mask
+
+def fit_ridge(X, y, mask, alpha=RIDGE_ALPHA):
+    """Ridge with intercept for every row through one batched solve of the normal equations.
+
+    Like sklearn, X and y are centered on their means, so the intercept is
+    not penalized. Returns (coefficients [products, features], intercepts).
+    """
+    weights = mask.astype(float)
+    counts = weights.sum(axis=1)
+    X_mean = np.einsum('pr,prf->pf', weights, X) / counts[:, None]
+    y_mean = (weights * y).sum(axis=1) / counts
+    X_centered = (X - X_mean[:, None, :]) * weights[:, :, None]
+    y_centered = (y - y_mean[:, None]) * weights
+    gram = np.einsum('prf,prg->pfg', X_centered, X_centered) + alpha * np.eye(X.shape[2])
+    moments = np.einsum('prf,pr->pf', X_centered, y_centered)
+    coefficients = np.linalg.solve(gram, moments[:, :, None])[:, :, 0]
+    intercepts = y_mean - np.einsum('pf,pf->p', X_mean, coefficients)
+    return coefficients, intercepts
+
+def solve_ridge(counts, feature_sums, target_sums, gram, moments, alpha=RIDGE_ALPHA):
+    """``fit_ridge`` from accumulated sums, X^T X (``gram``) and X^T y (``moments``) of every row"""
+    X_mean = feature_sums / counts[:, None]
+    y_mean = target_sums / counts
+    centered_gram = gram - counts[:, None, None] * np.einsum('pf,pg->pfg', X_mean, X_mean) + alpha * np.eye(gram.shape[1])
+    centered_moments = moments - counts[:, None] * X_mean * y_mean[:, None]
+    coefficients = np.linalg.solve(centered_gram, centered_moments[:, :, None])[:, :, 0]
+    intercepts = y_mean - np.einsum('pf,pf->p', X_mean, coefficients)
+    return coefficients, intercepts
+
+def build_future_features(origins, last_dates, last_prices, recent_averages, days_ahead):
+    """``predict_and_index`` inputs [products, 4] ``days_ahead`` days (a number or one per product) past ``last_dates``"""
+    future = last_dates + np.asarray(days_ahead, dtype=np.int64) * NANOSECONDS_PER_DAY
+    return np.stack(np.broadcast_arrays(
+        (future - origins) // NANOSECONDS_PER_DAY,
+        (get_days(future) + EPOCH_DAY_OF_WEEK) % 7,
+        last_prices,
+        recent_averages
+    ), axis=1).astype(float)
+
+def get_last_observations(dates, prices, lengths):
+    """(last date, last price, mean price of the last week) of every row"""
+    rows = np.arange(len(prices))
+    last = lengths - 1
+    last_dates = dates[rows, last]
+    inside = np.arange(prices.shape[1]) < lengths[:, None]
+    recent = inside & (dates > (last_dates - MOVING_AVERAGE_WINDOW * NANOSECONDS_PER_DAY)[:, None])
+    recent_averages = np.where(recent, prices, 0.0).sum(axis=1) / recent.sum(axis=1)
+    return last_dates, prices[rows, last], recent_averages
+
+def build_prediction_features(dates, prices, lengths, days_ahead, origins=None):
+    """``predict_and_index`` inputs for every row, returns (X [products, 4], last price)"""
+    if origins is None:
+        origins = dates[:, 0]
+    last_dates, last_prices, recent_averages = get_last_observations(dates, prices, lengths)
+    return build_future_features(origins, last_dates, last_prices, recent_averages, days_ahead), last_prices
+
+def predict_batch(histories, days_ahead=30, alpha=RIDGE_ALPHA, outlier_sigmas=OUTLIER_SIGMAS):
+    """Ridge forecasts ``days_ahead`` days past the last grid point of every product.
+
+    Matches resample_prices, preprocess, engineer_features, the full-data
+    Ridge of train_and_evaluate and predict_and_index, without the cross
+    validation scores nobody reads. Returns (product ids, predicted prices,
+    change indexes) of the products with enough history.
+    """
+    histories = resample_histories(histories)
+    lengths = histories.ends - histories.starts
+    histories = histories.select(np.flatnonzero(lengths >= MIN_HISTORY))
+    if not len(histories):
+        return np.array([], dtype=np.int64), np.array([]), np.array([])
+    dates, prices, lengths = remove_outliers(*histories.to_padded(), outlier_sigmas)
+    trainable = lengths - 1 >= MIN_TRAINING_ROWS
+    dates, prices, lengths = dates[trainable], prices[trainable], lengths[trainable]
+    product_ids = histories.product_ids[trainable]
+    if not len(product_ids):
+        return product_ids, np.array([]), np.array([])
+    # Histories shrink during cleanup, trailing padding is cut before the solve
+    width = int(lengths.max())
+    dates, prices = dates[:, :width], prices[:, :width]
+
+    X, y, mask = build_features(dates, prices, lengths)
+    coefficients, intercepts = fit_ridge(X, y, mask, alpha)
+    X_new, last_prices = build_prediction_features(dates, prices, lengths, days_ahead)
+    predicted = np.einsum('pf,pf->p', X_new, coefficients) + intercepts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (predicted - last_prices) / last_prices * 100
+    return product_ids, predicted, change
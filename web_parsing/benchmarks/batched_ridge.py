@@ -0,0 +1,82 @@
+"""Checks the batched Ridge engine against the per-product sklearn pipeline.
+
+Synthetic histories with gaps, missing prices and outliers go through
+resample_prices, preprocess, engineer_features, train_and_evaluate and
+predict_and_index
+one product at a time and through predict_batch at once. No database is
+needed:
+
+    python -m web_parsing.benchmarks.batched_ridge --products 2000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from ..batch_prediction import MIN_HISTORY, PriceHistories, predict_batch
+from ..price_prediction import engineer_features, predict_and_index, preprocess, resample_prices, train_and_evaluate
+
+def generate_histories(products, max_length, seed=0, outlier_rate=0.01, missing_rate=0.01):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, max_length + 1, products)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    ends = starts + lengths
+    total = int(lengths.sum())
+    # Recrawls every 2 to 72 hours, see recrawl_scheduler, sometimes a crawl or a few days are missing
+    steps = rng.choice([2, 6, 6, 9, 12, 30, 72, 78], total).astype('timedelta64[h]')
+    steps[starts] = rng.integers(0, 24 * 365, products).astype('timedelta64[h]')
+    product_of_row = np.repeat(np.arange(products), lengths)
+    dates = np.datetime64('2024-01-01T00:00', 'ns') + np.cumsum(steps.astype('timedelta64[ns]'))
+    dates -= np.repeat(dates[starts] - (np.datetime64('2024-01-01T00:00', 'ns') + steps[starts]), lengths)
+    walk = rng.normal(0, 0.01, total)
+    walk[starts] = 0
+    base = rng.uniform(50, 50000, products)
+    prices = np.round(base[product_of_row] * np.exp(np.cumsum(walk) - np.repeat(np.cumsum(walk)[starts], lengths)), 2)
+    prices[rng.random(total) < outlier_rate] *= 10
+    prices[rng.random(total) < missing_rate] = np.nan
+    return PriceHistories(np.arange(1, products + 1), dates, prices, starts, ends)
+
+def predict_per_product(histories, days_ahead):
+    predictions = dict()
+    for product_id, start, end in zip(histories.product_ids, histories.starts, histories.ends):
+        history = resample_prices(pd.DataFrame({'etl_date': histories.dates[start:end], 'price': histories.prices[start:end]}))
+        if len(history) < MIN_HISTORY:
+            continue
+        clean = preprocess(history)
+        X, y, _ = engineer_features(clean)
+        try:
+            _, model = train_and_evaluate(X, y)
+        except ValueError:
+            # Too few rows left for TimeSeriesSplit
+            continue
+        price, _, change = predict_and_index(model, clean, days_ahead)
+        predictions[int(product_id)] = (price, change)
+    return predictions
+
+def run(products, max_length, days_ahead):
+    histories = generate_histories(products, max_length)
+    start = time.perf_counter()
+    expected = predict_per_product(histories, days_ahead)
+    per_product_time = time.perf_counter() - start
+    start = time.perf_counter()
+    product_ids, prices, changes = predict_batch(histories, days_ahead)
+    batch_time = time.perf_counter() - start
+
+    batched = {int(product_id): (price, change) for product_id, price, change in zip(product_ids, prices, changes)}
+    price_errors = [abs(batched[key][0] - value[0]) / max(abs(value[0]), 1.0) for key, value in expected.items() if key in batched]
+    change_errors = [abs(batched[key][1] - value[1]) for key, value in expected.items() if key in batched]
+    print(f"{products} products, {int((histories.ends - histories.starts).sum())} observations, {days_ahead} days ahead")
+    print(f"  per product (sklearn): {per_product_time:7.2f}s, {len(expected)} predictions")
+    print(f"  batched:               {batch_time:7.2f}s, {len(batched)} predictions, x{per_product_time / batch_time:.0f}")
+    print(f"  same products: {set(expected) == set(batched)}")
+    print(f"  max relative price difference: {max(price_errors, default=0):.2e}")
+    print(f"  max change index difference:   {max(change_errors, default=0):.2e} percentage points")
+    return set(expected) == set(batched) and max(price_errors, default=0) < 1e-6 and max(change_errors, default=0) < 1e-4
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--products', type=int, default=2000)
+    argument_parser.add_argument('--max-length', type=int, default=400)
+    argument_parser.add_argument('--days-ahead', type=int, default=30)
+    arguments = argument_parser.parse_args()
+    matches = run(arguments.products, arguments.max_length, arguments.days_ahead)
+    print("OK, predictions match" if matches else "FAILED")
@@ -0,0 +1,73 @@
+"""Compares DataFrame.to_sql(method='multi') with the COPY based bulk writer.
+
+Rows are written to scratch copies of parsed_products and
+product_price_predictions that are dropped afterwards, so the benchmark can
+run against a live database:
+
+    python -m web_parsing.benchmarks.bulk_write --rows 100000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from ..bulk_writer import write_dataframe
+from ..db import get_engine, pooled_connection
+
+TABLES = {
+    'parsed_products': ['product_id', 'price_proceeded', 'etl_date', 'last_seen_at'],
+    'product_price_predictions': ['product_id', 'predicted_price', 'change_index', 'etl_date'],
+}
+
+def generate_rows(columns, rows):
+    rng = np.random.default_rng(0)
+    start = datetime(2025, 1, 1)
+    data = dict()
+    for column in columns:
+        if column == 'product_id':
+            data[column] = rng.integers(1, 5, rows)
+        elif column in ('etl_date', 'last_seen_at'):
+            data[column] = [start + timedelta(minutes=int(i)) for i in range(rows)]
+        else:
+            data[column] = rng.uniform(100, 100000, rows).round(2)
+    return pd.DataFrame(data)
+
+def create_scratch_table(table):
+    scratch_table = f'benchmark_{table}'
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+            cursor.execute(f"CREATE TABLE {scratch_table} (LIKE {table} INCLUDING DEFAULTS)")
+    return scratch_table
+
+def drop_scratch_table(scratch_table):
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {scratch_table}")
+
+def measure(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def run(rows):
+    engine = get_engine()
+    for table, columns in TABLES.items():
+        df = generate_rows(columns, rows)
+        scratch_table = create_scratch_table(table)
+        try:
+            to_sql_time = measure(lambda: df.to_sql(scratch_table, engine, if_exists='append', index=False, method='multi'))
+            copy_time = measure(lambda: write_dataframe(df, scratch_table))
+            upsert_time = measure(lambda: write_dataframe(df, scratch_table, upsert=True))
+        finally:
+            drop_scratch_table(scratch_table)
+        print(f"{table}: {rows} rows")
+        print(f"  to_sql multi: {to_sql_time:8.2f}s  ({rows / to_sql_time:10.0f} rows/s)")
+        print(f"  COPY:         {copy_time:8.2f}s  ({rows / copy_time:10.0f} rows/s)  x{to_sql_time / copy_time:.1f}")
+        print(f"  COPY upsert:  {upsert_time:8.2f}s  ({rows / upsert_time:10.0f} rows/s)  x{to_sql_time / upsert_time:.1f}")
+    engine.dispose()
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--rows', type=int, default=100000)
+    run(argument_parser.parse_args().rows)
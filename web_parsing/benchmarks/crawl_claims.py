@@ -0,0 +1,145 @@
+"""Checks that crawl workers sharing one database never crawl a product twice.
+
+Worker processes claim batches from product_crawl_state with
+claim_due_products and release them with update_crawl_state, exactly like
+parse_products.main, but the crawl itself is replaced by a short sleep per
+product. One worker can be made to crash after claiming its first batch to
+show that its products are picked up again once the lease expires.
+
+Everything runs in a scratch schema that is dropped afterwards:
+
+    python -m web_parsing.benchmarks.crawl_claims --products 20000 --workers 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta
+import psycopg2
+from ..db import get_db_params, pooled_connection
+from ..recrawl_scheduler import RecrawlPolicy, claim_due_products, update_crawl_state
+
+SCHEMA = 'crawl_claims_check'
+
+def create_schema(products):
+    connection = psycopg2.connect(**get_db_params())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+            cursor.execute(f"CREATE TABLE {SCHEMA}.products (id SERIAL PRIMARY KEY, marketplace_key TEXT, url TEXT)")
+            cursor.execute(f"CREATE TABLE {SCHEMA}.users_products_subscriptions (product_id INTEGER)")
+            cursor.execute(f"CREATE TABLE {SCHEMA}.product_crawl_state (LIKE public.product_crawl_state INCLUDING ALL)")
+            cursor.execute(f"CREATE TABLE {SCHEMA}.crawls (product_id INTEGER, worker_id TEXT, completed BOOLEAN)")
+            cursor.execute(
+                f"INSERT INTO {SCHEMA}.products (marketplace_key, url) "
+                f"SELECT 'rozetka', 'https://rozetka.com.ua/p' || g FROM generate_series(1, %s) g",
+                (products,)
+            )
+            cursor.execute(
+                f"INSERT INTO {SCHEMA}.product_crawl_state (product_id, next_due_at) "
+                f"SELECT id, now() - interval '1 minute' FROM {SCHEMA}.products"
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+def drop_schema():
+    connection = psycopg2.connect(**get_db_params())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        connection.commit()
+    finally:
+        connection.close()
+
+def run_worker(worker_id, batch_size, seconds_per_product, lease_seconds, crash):
+    policy = RecrawlPolicy()
+    lease_duration = timedelta(seconds=lease_seconds)
+    while True:
+        now = datetime.now()
+        with pooled_connection() as connection:
+            with connection.cursor() as cursor:
+                states = claim_due_products(cursor, batch_size, now, worker_id, lease_duration)
+                product_ids = [state.product_id for state in states]
+                cursor.execute(
+                    f"INSERT INTO {SCHEMA}.crawls SELECT unnest(%s::integer[]), %s, false",
+                    (product_ids, worker_id)
+                )
+        if not states:
+            # Leases of crashed workers may still expire and make products due again
+            with pooled_connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT count(*) FROM product_crawl_state WHERE next_due_at <= %s",
+                        (datetime.now(),)
+                    )
+                    if cursor.fetchone()[0] == 0:
+                        return
+            time.sleep(0.2)
+            continue
+        if crash:
+            os._exit(1)
+        time.sleep(seconds_per_product * len(states))
+        with pooled_connection() as connection:
+            with connection.cursor() as cursor:
+                update_crawl_state(cursor, states, {product_id: 1.0 for product_id in product_ids}, policy, now, worker_id)
+                cursor.execute(
+                    f"UPDATE {SCHEMA}.crawls SET completed = true WHERE worker_id = %s AND product_id = ANY(%s)",
+                    (worker_id, product_ids)
+                )
+
+def run(products, workers, batch_size, seconds_per_product, lease_seconds, crash):
+    create_schema(products)
+    # Every worker connects with the scratch schema first on its search path
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA},public'
+    start = time.perf_counter()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(f'worker-{i}', batch_size, seconds_per_product, lease_seconds, crash and i == 0)
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    del os.environ['PGOPTIONS']
+
+    connection = psycopg2.connect(**get_db_params())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT
+                    (SELECT count(*) FROM {SCHEMA}.products),
+                    count(DISTINCT product_id) FILTER (WHERE completed),
+                    count(*) FILTER (WHERE completed) - count(DISTINCT product_id) FILTER (WHERE completed),
+                    count(*) FILTER (WHERE NOT completed)
+                FROM {SCHEMA}.crawls
+            """)
+            total, crawled, crawled_twice, abandoned = cursor.fetchone()
+    finally:
+        connection.close()
+    drop_schema()
+    print(
+        f"{workers} worker(s): {elapsed:6.2f}s, {crawled}/{total} products crawled, "
+        f"{crawled_twice} crawled twice, {abandoned} claims abandoned by a crashed worker"
+    )
+    return crawled == total and crawled_twice == 0
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--products', type=int, default=20000)
+    argument_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    argument_parser.add_argument('--batch-size', type=int, default=200)
+    argument_parser.add_argument('--seconds-per-product', type=float, default=0.001)
+    argument_parser.add_argument('--lease-seconds', type=int, default=3)
+    argument_parser.add_argument('--crash', action='store_true', help='let the first worker die after its first claim')
+    arguments = argument_parser.parse_args()
+    results = [
+        run(arguments.products, workers, arguments.batch_size, arguments.seconds_per_product, arguments.lease_seconds, arguments.crash)
+        for workers in arguments.workers
+    ]
+    print("OK, no product was crawled twice" if all(results) else "FAILED")
@@ -0,0 +1,82 @@
+"""Checks incremental model states against predictions from the full history.
+
+Synthetic histories are folded into model states in ``--chunks`` slices
+of time, like prediction runs that each read the observations after the
+last grid point folded so far. With the outlier filter switched off, and with a single
+slice, the result has to match predict_batch on the whole history up to
+rounding of the sums. With the filter and several slices every slice is
+filtered on the history up to its end, so predictions may differ, the
+share more than 1% off is what the nightly full rebuild corrects. No
+database is needed:
+
+    python -m web_parsing.benchmarks.incremental_model --products 2000 --chunks 20
+"""
+import argparse
+import time
+import numpy as np
+from ..batch_prediction import OUTLIER_SIGMAS, PriceHistories, predict_batch
+from ..model_state import ModelStates, fold_histories, predict_states
+from .batched_ridge import generate_histories
+
+def slice_histories(histories, after, until):
+    """Observations with ``after`` (int64 nanoseconds, one per product) < date <= ``until`` as PriceHistories"""
+    after = np.repeat(after, histories.ends - histories.starts)
+    selected = (histories.dates.view(np.int64) > after) & (histories.dates <= until)
+    counts = np.add.reduceat(selected, histories.starts) if len(histories.starts) else np.array([], dtype=np.int64)
+    present = counts > 0
+    ends = np.cumsum(counts)[present]
+    return PriceHistories(histories.product_ids[present], histories.dates[selected], histories.prices[selected], ends - counts[present], ends)
+
+def fold_in_chunks(histories, chunks, outlier_sigmas):
+    """(states, seconds of the first slice, seconds of every later slice)"""
+    states = ModelStates.empty(histories.product_ids)
+    cutoffs = np.quantile(histories.dates.view(np.int64), np.linspace(0, 1, chunks + 1)[1:]).astype(np.int64).astype('datetime64[ns]')
+    cutoffs[-1] = histories.dates.max()
+    times = list()
+    for until in cutoffs:
+        # Both are sorted by product id
+        chunk = slice_histories(histories, states.last_dates, until)
+        start = time.perf_counter()
+        fold_histories(states, chunk, outlier_sigmas)
+        times.append(time.perf_counter() - start)
+    return states, times
+
+def compare(histories, chunks, days_ahead, outlier_sigmas=OUTLIER_SIGMAS):
+    product_ids, prices, changes = predict_batch(histories, days_ahead, outlier_sigmas=outlier_sigmas)
+    states, times = fold_in_chunks(histories, chunks, outlier_sigmas)
+    state_ids, state_prices, state_changes = predict_states(states, days_ahead)
+    expected = dict(zip(product_ids.tolist(), prices))
+    folded = dict(zip(state_ids.tolist(), state_prices))
+    common = [key for key in expected if key in folded]
+    errors = np.array([abs(folded[key] - expected[key]) / max(abs(expected[key]), 1.0) for key in common])
+    return set(expected) == set(folded), errors, times
+
+def run(products, max_length, chunks, days_ahead):
+    histories = generate_histories(products, max_length)
+    print(f"{products} products, {int((histories.ends - histories.starts).sum())} observations in {chunks} slices")
+    # A bound no price reaches switches the filter off
+    same_products, errors, times = compare(histories, chunks, days_ahead, outlier_sigmas=1e9)
+    print(f"  without outlier filter: same products {same_products}, max relative difference {errors.max():.2e}")
+    print(f"  fold time: {sum(times):.2f}s in total, {np.mean(times):.3f}s per slice")
+    matches = same_products and errors.max() < 1e-6
+
+    same_products, errors, _ = compare(histories, 1, days_ahead)
+    print(f"  whole history in one slice: same products {same_products}, max relative difference {errors.max():.2e}")
+    matches = matches and same_products and errors.max() < 1e-6
+
+    same_products, errors, _ = compare(histories, chunks, days_ahead)
+    print(
+        f"  {chunks} slices with the outlier filter: same products {same_products}, "
+        f"{np.mean(errors < 1e-6):.1%} identical, {np.mean(errors >= 0.01):.1%} more than 1% off"
+    )
+    return matches
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--products', type=int, default=2000)
+    argument_parser.add_argument('--max-length', type=int, default=400)
+    argument_parser.add_argument('--chunks', type=int, default=20)
+    argument_parser.add_argument('--days-ahead', type=int, default=30)
+    arguments = argument_parser.parse_args()
+    matches = run(arguments.products, arguments.max_length, arguments.chunks, arguments.days_ahead)
+    print("OK, folded models match" if matches else "FAILED")
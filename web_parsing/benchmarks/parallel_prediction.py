@@ -0,0 +1,74 @@
+"""Runs the prediction job with different worker counts and compares the output.
+
+Uses the synthetic history of the price_history benchmark in a scratch
+schema that is dropped afterwards. Every run must write the same rows in
+the same order:
+
+    python -m web_parsing.benchmarks.parallel_prediction --products 50000 --workers 1 2 4
+"""
+import argparse
+import os
+import time
+import psycopg2
+from ..db import get_db_params, pooled_connection
+from ..migrate import MIGRATIONS_DIRECTORY
+from ..price_prediction import batch_main
+from .price_history import SCHEMA, create_schema, drop_schema
+
+def read_predictions():
+    """(product_id, predicted_price, change_index) in insertion order, the tables are emptied for the next run"""
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT product_id, predicted_price, change_index FROM product_price_predictions ORDER BY id")
+            rows = cursor.fetchall()
+            cursor.execute("TRUNCATE product_price_predictions, product_model_state, product_models RESTART IDENTITY")
+    return rows
+
+def run(products, days, ranges, worker_counts):
+    create_schema(products, days, ranges)
+    connection = psycopg2.connect(**get_db_params())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                CREATE TABLE {SCHEMA}.product_price_predictions (
+                    id SERIAL PRIMARY KEY,
+                    product_id INTEGER,
+                    predicted_price NUMERIC,
+                    change_index NUMERIC,
+                    etl_date TIMESTAMP,
+                    history_last_seen_at TIMESTAMP,
+                    history_last_price NUMERIC
+                )
+            """)
+            cursor.execute(f"SET search_path = {SCHEMA}")
+            for migration_name in ('0006_product_model_state.sql', '0007_product_models.sql', '0009_price_observation_steps.sql'):
+                with open(os.path.join(MIGRATIONS_DIRECTORY, migration_name)) as migration:
+                    cursor.execute(migration.read())
+        connection.commit()
+    finally:
+        connection.close()
+    # No pooled connection exists yet, all of them and those of the workers see the scratch schema
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA},public'
+    outputs = dict()
+    try:
+        for workers in worker_counts:
+            start = time.perf_counter()
+            batch_main(days_ahead=30, workers=workers)
+            elapsed = time.perf_counter() - start
+            outputs[workers] = read_predictions()
+            print(f"  {workers:2d} workers: {elapsed:7.2f}s, {len(outputs[workers])} predictions")
+    finally:
+        del os.environ['PGOPTIONS']
+        drop_schema()
+    reference = outputs[worker_counts[0]]
+    return bool(reference) and all(rows == reference for rows in outputs.values())
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--products', type=int, default=50000)
+    argument_parser.add_argument('--days', type=int, default=14)
+    argument_parser.add_argument('--ranges', type=int, default=4, help='distinct prices per product')
+    argument_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    arguments = argument_parser.parse_args()
+    identical = run(arguments.products, arguments.days, arguments.ranges, arguments.workers)
+    print("OK, identical output" if identical else "FAILED, output differs")
@@ -0,0 +1,151 @@
+"""Compares per-product and per-batch price history loading for predictions.
+
+The per-product variant is what batch_main did before, one pd.read_sql
+query per product. Both read the same synthetic history from a scratch
+schema that is dropped afterwards. The per-product variant is measured on
+the first ``--legacy-products`` products and extrapolated:
+
+    python -m web_parsing.benchmarks.price_history --products 100000
+"""
+import argparse
+import math
+import os
+import time
+import pandas as pd
+import psycopg2
+from ..db import get_db_params, get_engine, pooled_connection
+from ..price_prediction import HISTORY_FETCH_SIZE, fetch_price_histories
+
+SCHEMA = 'price_history_check'
+BATCH_SIZE = 1000
+
+def create_schema(products, days, ranges):
+    connection = psycopg2.connect(**get_db_params())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+            cursor.execute(f"CREATE TABLE {SCHEMA}.products (id INTEGER PRIMARY KEY)")
+            cursor.execute(f"""
+                CREATE TABLE {SCHEMA}.parsed_products (
+                    product_id INTEGER,
+                    price_proceeded NUMERIC,
+                    etl_date TIMESTAMP NOT NULL,
+                    last_seen_at TIMESTAMP NOT NULL,
+                    UNIQUE (product_id, etl_date) INCLUDE (price_proceeded, last_seen_at)
+                )
+            """)
+            cursor.execute(f"INSERT INTO {SCHEMA}.products SELECT generate_series(1, %s)", (products,))
+            # ``ranges`` prices per product, each seen every 6 hours for an equal share of ``days``
+            range_hours = days * 24 // ranges
+            cursor.execute(f"""
+                INSERT INTO {SCHEMA}.parsed_products
+                SELECT
+                    p,
+                    round((100 + random() * 1000)::numeric, 2),
+                    timestamp '2025-01-01' + r * %s * interval '1 hour',
+                    timestamp '2025-01-01' + ((r + 1) * %s - 6) * interval '1 hour'
+                FROM generate_series(1, %s) p, generate_series(0, %s) r
+            """, (range_hours, range_hours, products, ranges - 1))
+            cursor.execute(f"""
+                CREATE VIEW {SCHEMA}.price_observations AS
+                SELECT product_id, etl_date, price_proceeded
+                FROM {SCHEMA}.parsed_products
+                UNION ALL
+                SELECT product_id, last_seen_at, price_proceeded
+                FROM {SCHEMA}.parsed_products
+                WHERE last_seen_at > etl_date
+            """)
+            cursor.execute(f"ANALYZE {SCHEMA}.parsed_products")
+        connection.commit()
+    finally:
+        connection.close()
+
+def drop_schema():
+    connection = psycopg2.connect(**get_db_params())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        connection.commit()
+    finally:
+        connection.close()
+
+def product_id_batches():
+    """Product ids in batches of BATCH_SIZE, one FETCH each"""
+    with pooled_connection() as connection:
+        with connection.cursor(name="product_id_cursor") as cursor:
+            cursor.execute("SELECT id FROM products ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+
+def load_per_product(limit):
+    """Histories loaded the old way, returns (products, rows, round trips)"""
+    sql = """
+        SELECT etl_date, price_proceeded AS price
+        FROM price_observations
+        WHERE product_id = %s
+        ORDER BY etl_date
+    """
+    products = rows = round_trips = 0
+    for batch in product_id_batches():
+        round_trips += 1
+        for product_id in batch[:limit - products]:
+            df = pd.read_sql(sql, con=get_engine(), params=(product_id,))
+            df['etl_date'] = pd.to_datetime(df['etl_date'])
+            products += 1
+            rows += len(df)
+            round_trips += 1
+        if products >= limit:
+            break
+    return products, rows, round_trips
+
+def load_per_batch():
+    """Histories loaded with fetch_price_histories, returns (products, rows, round trips)"""
+    products = rows = round_trips = 0
+    for batch in product_id_batches():
+        batch_rows = 0
+        for _, df in fetch_price_histories(batch):
+            products += 1
+            batch_rows += len(df)
+        # Product ids, DECLARE, one FETCH per fetch_size rows, the final empty FETCH and CLOSE
+        round_trips += 4 + math.ceil(batch_rows / HISTORY_FETCH_SIZE)
+        rows += batch_rows
+    return products, rows, round_trips
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def run(products, days, ranges, legacy_products):
+    create_schema(products, days, ranges)
+    # Every pooled connection of this process starts with the scratch schema on its search path
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA},public'
+    try:
+        batch_time, (batch_products, batch_rows, batch_round_trips) = measure(load_per_batch)
+        legacy_time, (legacy_count, legacy_rows, legacy_round_trips) = measure(load_per_product, legacy_products)
+    finally:
+        del os.environ['PGOPTIONS']
+        drop_schema()
+    scale = batch_products / legacy_count
+    print(f"{batch_products} products, {batch_rows} observations")
+    print(
+        f"  per product: {legacy_time:7.2f}s, {legacy_round_trips} round trips for {legacy_count} products, "
+        f"about {legacy_time * scale:.0f}s and {round(legacy_round_trips * scale)} round trips for all"
+    )
+    print(
+        f"  per batch:   {batch_time:7.2f}s, {batch_round_trips} round trips, "
+        f"x{legacy_time * scale / batch_time:.1f}"
+    )
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--products', type=int, default=100000)
+    argument_parser.add_argument('--days', type=int, default=14)
+    argument_parser.add_argument('--ranges', type=int, default=4, help='distinct prices per product')
+    argument_parser.add_argument('--legacy-products', type=int, default=5000)
+    arguments = argument_parser.parse_args()
+    run(arguments.products, arguments.days, arguments.ranges, arguments.legacy_products)
@@ -0,0 +1,54 @@
+"""Compares row-by-row and batch price normalization on raw price strings.
+
+The row-by-row variant is what parse_products did before, normalize_price
+applied to every row through Series.apply. The batch variant parses every
+distinct string once, ``--amounts`` sets how many distinct amounts the
+rows draw from:
+
+    python -m web_parsing.benchmarks.price_normalization --rows 1000000 --amounts 20000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from ..price_normalization import PriceLocale, normalize_currencies, normalize_currency, normalize_price, normalize_prices
+
+def generate_raw_prices(rows, distinct_amounts):
+    rng = np.random.default_rng(0)
+    amounts = rng.integers(1, distinct_amounts + 1, rows) * 10 - 1
+    cents = rng.integers(0, 100, rows)
+    formats = [
+        lambda amount, cent: f"{amount:,}".replace(',', ' ') + ' ₴',
+        lambda amount, cent: f"{amount:,}.{cent:02d} USD",
+        lambda amount, cent: f"{amount},{cent:02d} грн",
+        lambda amount, cent: f"{amount:,}",
+        lambda amount, cent: 'Немає в наявності',
+    ]
+    choices = rng.integers(0, len(formats), rows)
+    return pd.Series([formats[choice](amount, cent) for choice, amount, cent in zip(choices, amounts, cents)], dtype=object)
+
+def measure(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def run(rows, distinct_amounts):
+    raw_prices = generate_raw_prices(rows, distinct_amounts)
+    print(f"{rows} raw price strings, {raw_prices.nunique()} distinct")
+    for name, locale in (('auto', None), ('decimal comma', PriceLocale(decimal_separator=','))):
+        kwargs = {} if locale is None else {'locale': locale}
+        row_time, row_prices = measure(lambda: raw_prices.apply(lambda raw: normalize_price(raw, **kwargs)))
+        vector_time, vector_prices = measure(lambda: normalize_prices(raw_prices, **kwargs))
+        same = np.allclose(row_prices.astype(float), vector_prices, equal_nan=True)
+        print(f"  prices ({name}): apply {row_time:6.2f}s, batch {vector_time:6.2f}s, x{row_time / vector_time:.1f}, same results: {same}")
+    row_time, row_currencies = measure(lambda: raw_prices.apply(normalize_currency))
+    vector_time, vector_currencies = measure(lambda: normalize_currencies(raw_prices))
+    same = row_currencies.fillna('-').tolist() == vector_currencies.fillna('-').tolist()
+    print(f"  currencies:     apply {row_time:6.2f}s, batch {vector_time:6.2f}s, x{row_time / vector_time:.1f}, same results: {same}")
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argument_parser.add_argument('--rows', type=int, default=1000000)
+    argument_parser.add_argument('--amounts', type=int, default=20000, help='distinct amounts before formatting')
+    arguments = argument_parser.parse_args()
+    run(arguments.rows, arguments.amounts)
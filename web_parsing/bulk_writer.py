@@ -0,0 +1,120 @@
+from psycopg2 import sql
+from .db import pooled_connection
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+def format_array_element(value):
+    """Element of a PostgreSQL array literal, quoted when it has to be"""
+    if value is None or value != value:
+        return 'NULL'
+    value = str(value)
+    if not value or any(character in value for character in ' ,{}"\\'):
+        value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return value
+
+def format_copy_value(value):
+    """Value in the COPY text format, NaN and NaT from pandas become NULL, lists become arrays"""
+    if isinstance(value, (list, tuple)):
+        value = '{' + ','.join(format_array_element(element) for element in value) + '}'
+    if value is None or value != value:
+        return '\\N'
+    value = str(value)
+    if '\\' in value or '\t' in value or '\n' in value or '\r' in value:
+        value = value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return value
+
+class CopyStream:
+    """File-like object producing COPY text lines from row tuples on demand.
+
+    ``copy_expert`` pulls the data with ``read``, so only about
+    ``COPY_BUFFER_SIZE`` characters of formatted rows exist at any time.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.row_count = 0
+        self.__buffer = ''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = COPY_BUFFER_SIZE
+        lines = [self.__buffer]
+        length = len(self.__buffer)
+        while length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = '\t'.join([format_copy_value(value) for value in row]) + '\n'
+            lines.append(line)
+            length += len(line)
+            self.row_count += 1
+        data = ''.join(lines)
+        self.__buffer = data[size:]
+        return data[:size]
+
+def copy_rows(cursor, table, columns, rows):
+    """Stream ``rows`` into ``table`` with COPY FROM STDIN, returns the number of rows copied"""
+    stream = CopyStream(rows)
+    statement = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    )
+    cursor.copy_expert(statement.as_string(cursor), stream, size=COPY_BUFFER_SIZE)
+    return stream.row_count
+
+def bulk_insert(table, columns, rows):
+    """Append ``rows`` to ``table`` in a single COPY"""
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            return copy_rows(cursor, table, columns, rows)
+
+def upsert_rows(cursor, table, columns, rows, conflict_columns=None, update_columns=None, update_condition=None):
+    """COPY ``rows`` into a staging table and merge them into ``table``.
+
+    Rows conflicting on ``conflict_columns`` update ``update_columns`` (all
+    other columns by default), only where the ``update_condition`` SQL
+    holds when one is given. Without ``conflict_columns`` conflicting rows
+    are skipped. Returns the number of rows inserted or updated, skipped
+    rows are not counted.
+    """
+    staging_table = f'{table}_staging'
+    column_list = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    if conflict_columns:
+        if update_columns is None:
+            update_columns = [column for column in columns if column not in conflict_columns]
+        conflict_action = sql.SQL("ON CONFLICT ({}) DO UPDATE SET {}").format(
+            sql.SQL(', ').join(sql.Identifier(column) for column in conflict_columns),
+            sql.SQL(', ').join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column)) for column in update_columns
+            )
+        )
+        if update_condition is not None:
+            conflict_action = sql.SQL("{} WHERE {}").format(conflict_action, update_condition)
+    else:
+        conflict_action = sql.SQL("ON CONFLICT DO NOTHING")
+
+    # Only the written columns, so serial defaults and NOT NULL ids stay on the target table
+    cursor.execute(sql.SQL(
+        "CREATE TEMP TABLE IF NOT EXISTS {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+    ).format(sql.Identifier(staging_table), column_list, sql.Identifier(table)))
+    copy_rows(cursor, staging_table, columns, rows)
+    cursor.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} {}").format(
+        sql.Identifier(table), column_list, column_list, sql.Identifier(staging_table), conflict_action
+    ))
+    row_count = cursor.rowcount
+    cursor.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(staging_table)))
+    return row_count
+
+def bulk_upsert(table, columns, rows, conflict_columns=None, update_columns=None):
+    """``upsert_rows`` in a transaction of its own"""
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            return upsert_rows(cursor, table, columns, rows, conflict_columns, update_columns)
+
+def write_dataframe(df, table, upsert=False, conflict_columns=None, update_columns=None):
+    """Write every row of ``df`` to ``table`` using the DataFrame columns"""
+    columns = list(df.columns)
+    rows = df.itertuples(index=False, name=None)
+    if upsert:
+        return bulk_upsert(table, columns, rows, conflict_columns, update_columns)
+    return bulk_insert(table, columns, rows)
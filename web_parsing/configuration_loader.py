@@ -1,5 +1,6 @@
 import sys
 import os
+import logging
 import copy
 import json
 from sqlalchemy import create_engine
@@ -8,6 +9,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, String, JSON, DateTime
 from datetime import datetime
 from sqlalchemy.ext.mutable import MutableDict
+from .db import get_engine
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -29,8 +33,9 @@ class MarketplaceConfiguration(Base):
 class ConfigurationLoader:
     __configurations = None
 
-    def __init__(self, db_url, conf_file_path=None, required_fields_path=None):
-        self.engine = create_engine(db_url)
+    def __init__(self, db_url=None, conf_file_path=None, required_fields_path=None):
+        # Without a url the process-wide engine of web_parsing.db is used
+        self.engine = get_engine() if db_url is None else create_engine(db_url)
         self.Session = sessionmaker(bind=self.engine)
         self.conf_file_path = conf_file_path
         self.required_fields_path = required_fields_path
@@ -47,7 +52,7 @@ class ConfigurationLoader:
     def __load_configurations_from_db(self):
         session = self.Session()
         try:
-            print("Loading configurations from database...")
+            logger.debug("Loading configurations from database")
             config = session.query(MarketplaceConfiguration).all()[0]
             if not config:
                 raise Exception("No configurations found in the database.")
@@ -0,0 +1,71 @@
+import os
+import socket
+from datetime import datetime, timedelta
+
+DEFAULT_RESUME_WINDOW_HOURS = 6
+
+class CrawlRun:
+    def __init__(self, id, etl_date, last_product_id, resumed=False):
+        self.id = id
+        self.etl_date = etl_date
+        self.last_product_id = last_product_id
+        self.resumed = resumed
+
+def get_worker_id():
+    """Name of this crawl worker, the container hostname unless CRAWL_WORKER_ID is set"""
+    return os.getenv('CRAWL_WORKER_ID') or socket.gethostname()
+
+def get_resume_window():
+    return timedelta(hours=float(os.getenv('CRAWL_RESUME_WINDOW_HOURS', DEFAULT_RESUME_WINDOW_HOURS)))
+
+def start_or_resume_run(cursor, worker_id, resume_window=None):
+    """Resume the latest unfinished run of the worker started within ``resume_window``, otherwise start a new one.
+
+    Older unfinished runs of the worker are marked abandoned, their prices
+    keep the etl_date they were parsed with.
+    """
+    if resume_window is None:
+        resume_window = get_resume_window()
+    now = datetime.now().replace(microsecond=0)
+    cursor.execute("""
+        SELECT id, etl_date, last_product_id
+        FROM crawl_runs
+        WHERE worker_id = %s AND status = 'running' AND started_at >= %s
+        ORDER BY started_at DESC
+        LIMIT 1
+    """, (worker_id, now - resume_window))
+    row = cursor.fetchone()
+    if row is not None:
+        run_id, etl_date, last_product_id = row
+        cursor.execute(
+            "UPDATE crawl_runs SET status = 'abandoned', updated_at = now() WHERE worker_id = %s AND status = 'running' AND id <> %s",
+            (worker_id, run_id)
+        )
+        return CrawlRun(run_id, etl_date, last_product_id, resumed=True)
+
+    cursor.execute(
+        "UPDATE crawl_runs SET status = 'abandoned', updated_at = now() WHERE worker_id = %s AND status = 'running'",
+        (worker_id,)
+    )
+    cursor.execute(
+        "INSERT INTO crawl_runs (worker_id, etl_date, started_at) VALUES (%s, %s, %s) RETURNING id",
+        (worker_id, now, now)
+    )
+    return CrawlRun(cursor.fetchone()[0], now, 0)
+
+def checkpoint_run(cursor, run_id, last_product_id, products_parsed, products_failed):
+    """Record a finished batch, meant to commit together with the batch rows"""
+    cursor.execute("""
+        UPDATE crawl_runs
+        SET last_product_id = %s,
+            products_parsed = products_parsed + %s,
+            products_failed = products_failed + %s,
+            updated_at = now()
+        WHERE id = %s
+    """, (last_product_id, products_parsed, products_failed, run_id))
+
+def finish_run(cursor, run_id):
+    cursor.execute(
+        "UPDATE crawl_runs SET status = 'finished', finished_at = now(), updated_at = now() WHERE id = %s",
+        (run_id,)
+    )
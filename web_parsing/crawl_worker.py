@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+import logging
+from datetime import datetime
+
+# Add parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web_parsing.parse_products import main as crawl_due_products
+from web_parsing.crawl_runs import get_worker_id
+from web_parsing.tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_SECONDS = 60
+
+def run_worker():
+    """Crawl due products until none are left, then poll for newly due ones.
+
+    Any number of workers can run against the same database, products are
+    leased with SKIP LOCKED so each due product is crawled by one of them.
+    """
+    idle_seconds = int(os.getenv('CRAWL_IDLE_SECONDS', DEFAULT_IDLE_SECONDS))
+    logger.info(f"Crawl worker {get_worker_id()} started")
+    while True:
+        try:
+            crawled = crawl_due_products()
+        except Exception as e:
+            logger.error(f"[{datetime.now()}] Crawl failed: {e}")
+            crawled = 0
+        if not crawled:
+            time.sleep(idle_seconds)
+
+if __name__ == "__main__":
+    configure_logging()
+    run_worker()
@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from sqlalchemy import create_engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_POOL_OVERFLOW = 4
+DEFAULT_POOL_RECYCLE_SECONDS = 1800
+DEFAULT_STATEMENT_TIMEOUT_MS = 300000
+DEFAULT_POOL_TIMEOUT_SECONDS = 30
+
+_engine = None
+_pool = None
+_pool_slots = None
+_lock = threading.Lock()
+
+def get_db_params():
+    """Connection parameters of the parser database, the one place DB_* variables are read"""
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', '5432'),
+        'dbname': os.getenv('DB_NAME', 'parse_db'),
+        'user': os.getenv('DB_USER', 'parser'),
+        'password': os.getenv('DB_PASSWORD', '123456')
+    }
+
+def get_db_url(driver='psycopg2'):
+    params = get_db_params()
+    return f"postgresql+{driver}://{params['user']}:{params['password']}@{params['host']}:{params['port']}/{params['dbname']}"
+
+def get_pool_size():
+    return int(os.getenv('DB_POOL_SIZE', DEFAULT_POOL_SIZE))
+
+def get_pool_timeout():
+    return float(os.getenv('DB_POOL_TIMEOUT_SECONDS', DEFAULT_POOL_TIMEOUT_SECONDS))
+
+def get_connection_options():
+    """Session settings every connection starts with, a statement_timeout of 0 disables it.
+
+    Passing options replaces PGOPTIONS, so its settings are carried over.
+    """
+    statement_timeout = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', DEFAULT_STATEMENT_TIMEOUT_MS))
+    return f"{os.getenv('PGOPTIONS', '')} -c statement_timeout={statement_timeout}".strip()
+
+def get_engine():
+    """SQLAlchemy engine shared by the whole process"""
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = create_engine(
+                get_db_url(),
+                pool_size=get_pool_size(),
+                max_overflow=int(os.getenv('DB_POOL_OVERFLOW', DEFAULT_POOL_OVERFLOW)),
+                pool_recycle=int(os.getenv('DB_POOL_RECYCLE_SECONDS', DEFAULT_POOL_RECYCLE_SECONDS)),
+                pool_pre_ping=True,
+                connect_args={'options': get_connection_options()}
+            )
+        return _engine
+
+def get_connection_pool():
+    """Pool of raw psycopg2 connections shared by the whole process, for COPY and server-side cursors"""
+    return get_pool_and_slots()[0]
+
+def get_pool_and_slots():
+    """The connection pool and the semaphore of its connections.
+
+    ThreadedConnectionPool raises once every connection is taken, callers
+    hold a slot instead to wait for a free one.
+    """
+    global _pool, _pool_slots
+    with _lock:
+        if _pool is None:
+            pool_size = get_pool_size()
+            _pool = ThreadedConnectionPool(1, pool_size, options=get_connection_options(), **get_db_params())
+            _pool_slots = threading.BoundedSemaphore(pool_size)
+        return _pool, _pool_slots
+
+def is_alive(connection):
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def pooled_connection():
+    """Connection from the pool, committed on success and rolled back on error.
+
+    Waits up to DB_POOL_TIMEOUT_SECONDS while every connection is in use.
+    Connections are pinged when taken, dead ones are replaced instead of
+    failing the caller.
+    """
+    pool, slots = get_pool_and_slots()
+    timeout = get_pool_timeout()
+    if not slots.acquire(timeout=timeout):
+        raise Exception(f"No database connection became free within {timeout} seconds.")
+    try:
+        connection = pool.getconn()
+        while not is_alive(connection):
+            logger.warning("Replacing a dead database connection")
+            pool.putconn(connection, close=True)
+            connection = pool.getconn()
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            if not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            pool.putconn(connection, close=bool(connection.closed))
+    finally:
+        slots.release()
+
+def reset_after_fork():
+    """A forked child must not use or close the sockets it inherited from its parent"""
+    global _engine, _pool, _pool_slots, _lock
+    if _engine is not None:
+        _engine.dispose(close=False)
+    _engine = None
+    _pool = None
+    _pool_slots = None
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
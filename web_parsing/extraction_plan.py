@@ -0,0 +1,181 @@
+import soupsieve
+import lxml.html
+from lxml import etree
+from bs4 import BeautifulSoup, SoupStrainer
+from .price_normalization import PriceLocale
+
+EXTRACTION_BACKENDS = ('soup', 'soup_strainer', 'lxml')
+DEFAULT_EXTRACTION_BACKEND = 'soup'
+
+string_value = etree.XPath('string()')
+
+def escape_attribute_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def build_class_selector(tag, class_value):
+    """CSS selector for ``tag`` elements carrying every class listed in ``class_value``.
+
+    Attribute selectors are used instead of ``.class`` so class names such as
+    '1' (used by touch) do not need CSS identifier escaping.
+    """
+    classes = class_value.split()
+    return tag + ''.join(f'[class~="{escape_attribute_value(cls)}"]' for cls in classes)
+
+def xpath_literal(value):
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    parts = value.split('"')
+    return 'concat(' + ', \'"\', '.join(f'"{part}"' for part in parts) + ')'
+
+def build_class_xpath(axis, tag, class_value):
+    """XPath counterpart of ``build_class_selector`` returning the first match in document order"""
+    conditions = ''.join(
+        f"[contains(concat(' ', normalize-space(@class), ' '), {xpath_literal(' ' + cls + ' ')})]"
+        for cls in class_value.split()
+    )
+    return f'({axis}{tag}{conditions})[1]'
+
+class FieldPlan:
+    """Precompiled selectors for a single configured field.
+
+    The container div is located first, then the element selectors are tried
+    inside it in the configured order until one of them matches.
+    """
+
+    def __init__(self, field_config):
+        self.name = field_config['name']
+        self.div_class = field_config['html_div_class']
+        self.element_type = field_config['html_element_in_div_type']
+        self.container_selector = soupsieve.compile(build_class_selector('div', self.div_class))
+
+        # Filter out empty strings from the classes list
+        element_classes = [cls for cls in field_config['html_element_in_div_class'] if cls.strip()]
+        if element_classes:
+            self.element_selectors = [
+                soupsieve.compile(build_class_selector(self.element_type, cls)) for cls in element_classes
+            ]
+        else:
+            self.element_selectors = [soupsieve.compile(self.element_type)]
+
+        self.container_xpath = etree.XPath(build_class_xpath('//', 'div', self.div_class))
+        if element_classes:
+            self.element_xpaths = [
+                etree.XPath(build_class_xpath('.//', self.element_type, cls)) for cls in element_classes
+            ]
+        else:
+            self.element_xpaths = [etree.XPath(f'(.//{self.element_type})[1]')]
+
+    def extract(self, soup):
+        field_div = self.container_selector.select_one(soup)
+        if field_div is None:
+            raise self.__missing_div()
+
+        for element_selector in self.element_selectors:
+            field_element = element_selector.select_one(field_div)
+            if field_element is not None:
+                return field_element.text.strip()
+
+        raise self.__missing_element()
+
+    def extract_from_tree(self, tree):
+        field_divs = self.container_xpath(tree)
+        if not field_divs:
+            raise self.__missing_div()
+
+        for element_xpath in self.element_xpaths:
+            field_elements = element_xpath(field_divs[0])
+            if field_elements:
+                return string_value(field_elements[0]).strip()
+
+        raise self.__missing_element()
+
+    def __missing_div(self):
+        return Exception(f"Div class for the '{self.name}' field couldn't be found, please check it.")
+
+    def __missing_element(self):
+        return Exception(f"Element '{self.element_type}' inside '{self.div_class}' div for the '{self.name}' field couldn't be found, please check it.")
+
+class FieldLocator:
+    """Follows a page fed in chunks until the first container div of every field is closed.
+
+    Extraction only ever looks inside the first matching container, so once
+    all of them are closed the bytes fed so far extract to the same values as
+    the whole page.
+    """
+
+    def __init__(self, fields, encoding=None):
+        self.__pending = {field.name: set(field.div_class.split()) for field in fields}
+        self.__started = set()
+        self.__open = dict()
+        try:
+            self.__parser = etree.HTMLPullParser(events=('start', 'end'), tag='div', encoding=encoding)
+        except LookupError:
+            self.__parser = etree.HTMLPullParser(events=('start', 'end'), tag='div')
+
+    def feed(self, data):
+        """Feed the next chunk, returns True once every field container has been read"""
+        self.__parser.feed(data)
+        for event, element in self.__parser.read_events():
+            if event == 'start':
+                classes = set((element.get('class') or '').split())
+                names = [
+                    name for name, div_classes in self.__pending.items()
+                    if name not in self.__started and div_classes <= classes
+                ]
+                if names:
+                    self.__started.update(names)
+                    self.__open[element] = names
+            else:
+                for name in self.__open.pop(element, ()):
+                    self.__pending.pop(name, None)
+        return not self.__pending
+
+class ExtractionPlan:
+    """Field plans of one marketplace plus the backend used to build the document.
+
+    ``soup`` builds a full BeautifulSoup tree, ``soup_strainer`` only keeps the
+    configured field divs, and ``lxml`` parses the raw bytes with lxml and runs
+    precompiled XPath expressions without creating any BeautifulSoup objects.
+    With ``structured_data`` enabled the page metadata is read first and the
+    document is only built for fields the metadata did not provide.
+    """
+
+    def __init__(self, marketplace_key, marketplace_configuration):
+        self.marketplace_key = marketplace_key
+        self.backend = marketplace_configuration.get('extraction_backend') or DEFAULT_EXTRACTION_BACKEND
+        if self.backend not in EXTRACTION_BACKENDS:
+            raise Exception(f"Unknown extraction backend '{self.backend}' for '{marketplace_key}' marketplace. Check configuration file.")
+        self.fields = [FieldPlan(field_config) for field_config in marketplace_configuration['fields']]
+        self.structured_data = bool(marketplace_configuration.get('structured_data'))
+        self.price_locale = PriceLocale.from_config(marketplace_configuration.get('price_locale'))
+
+        self.strainer = None
+        if self.backend == 'soup_strainer':
+            self.strainer = SoupStrainer('div', attrs={'class': [field.div_class for field in self.fields]})
+
+    def parse_document(self, content, encoding=None):
+        """Build the document for ``extract_field`` from page bytes (or text) and the declared encoding"""
+        if self.backend == 'lxml':
+            if isinstance(content, bytes):
+                return lxml.html.document_fromstring(content, parser=lxml.html.HTMLParser(encoding=encoding))
+            return lxml.html.document_fromstring(content)
+        if isinstance(content, bytes):
+            return BeautifulSoup(content, 'lxml', parse_only=self.strainer, from_encoding=encoding)
+        return BeautifulSoup(content, 'lxml', parse_only=self.strainer)
+
+    def create_locator(self, encoding=None):
+        return FieldLocator(self.fields, encoding)
+
+    def extract_field(self, field_plan, document):
+        if self.backend == 'lxml':
+            return field_plan.extract_from_tree(document)
+        return field_plan.extract(document)
+
+def compile_extraction_plans(configuration_object):
+    """Compile every marketplace configuration once, keyed by marketplace key"""
+    return {
+        key: ExtractionPlan(key, marketplace_configuration)
+        for key, marketplace_configuration in configuration_object.items()
+    }
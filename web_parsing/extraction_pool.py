@@ -0,0 +1,28 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from .marketplace_parser import MarketplaceParser
+
+_worker_parser = None
+
+def init_extraction_worker(configuration_object):
+    """Build the parser once per worker process, the compiled plans never cross process boundaries"""
+    global _worker_parser
+    _worker_parser = MarketplaceParser(configuration_object)
+
+def extract_page(url, content, encoding):
+    return _worker_parser.parse_product_from_html(content, url, encoding)
+
+def get_extraction_workers():
+    return int(os.getenv('CRAWL_EXTRACTION_WORKERS', os.cpu_count() or 1))
+
+def create_extraction_pool(configuration_object, workers=None):
+    """Process pool running MarketplaceParser field extraction, None when extraction should stay in-process"""
+    if workers is None:
+        workers = get_extraction_workers()
+    if workers <= 0:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_extraction_worker,
+        initargs=(configuration_object,)
+    )
@@ -0,0 +1,72 @@
+from urllib.parse import urlsplit
+from .utils import fingerprint_configuration
+
+MAX_CACHED_ROUTERS = 8
+
+def extract_host(url):
+    """Lower-cased hostname of ``url`` without a leading 'www.', None if there is none"""
+    url = url.strip()
+    if '//' not in url:
+        url = '//' + url
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+class MarketplaceRouter:
+    """Maps product URLs to marketplace keys by hostname.
+
+    Every host from ``marketplace_url`` is stored in a dict. A URL is resolved
+    by looking up its host and then its parent domains, so a config listing
+    'https://rozetka.com.ua' also serves 'hard.rozetka.com.ua', while the
+    most specific configured host always wins.
+    """
+
+    def __init__(self, configuration_object):
+        self.__hosts = dict()
+        for key, marketplace_configuration in configuration_object.items():
+            marketplace_urls = marketplace_configuration['marketplace_url']
+            if isinstance(marketplace_urls, str):
+                marketplace_urls = [marketplace_urls]
+            for marketplace_url in marketplace_urls:
+                host = extract_host(marketplace_url)
+                if host is None:
+                    raise Exception(f"Invalid marketplace url '{marketplace_url}' for '{key}' marketplace. Check configuration file.")
+                registered_key = self.__hosts.get(host)
+                if registered_key is not None and registered_key != key:
+                    raise Exception(f"Host '{host}' is configured for both '{registered_key}' and '{key}' marketplaces. Check configuration file.")
+                self.__hosts[host] = key
+
+    def resolve(self, url):
+        """Marketplace key serving ``url``, None if the URL is not supported"""
+        host = extract_host(url)
+        if host is None:
+            return None
+        key = self.__hosts.get(host)
+        if key is not None:
+            return key
+        labels = host.split('.')
+        for i in range(1, len(labels) - 1):
+            key = self.__hosts.get('.'.join(labels[i:]))
+            if key is not None:
+                return key
+        return None
+
+_routers = dict()
+
+def get_router(configuration_object):
+    """Router for the configuration, built once per configuration version"""
+    fingerprint = fingerprint_configuration(configuration_object)
+    router = _routers.get(fingerprint)
+    if router is None:
+        if len(_routers) >= MAX_CACHED_ROUTERS:
+            _routers.clear()
+        router = MarketplaceRouter(configuration_object)
+        _routers[fingerprint] = router
+    return router
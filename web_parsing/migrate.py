@@ -0,0 +1,54 @@
+import os
+import logging
+from .db import pooled_connection
+from .tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# Any constant works, it only has to be the same for every process applying migrations
+MIGRATIONS_LOCK_ID = 7420135
+
+def get_migrations(directory=MIGRATIONS_DIRECTORY):
+    """(version, path) of every migration file, ordered by version"""
+    migrations = list()
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.sql'):
+            migrations.append((file_name[:-len('.sql')], os.path.join(directory, file_name)))
+    return migrations
+
+def apply_migrations(directory=MIGRATIONS_DIRECTORY):
+    """Apply the migrations missing from schema_migrations, returns the applied versions.
+
+    Everything runs in one transaction under an advisory lock, so the parser
+    and the backend starting together never apply a migration twice and a
+    failing migration leaves the schema untouched.
+    """
+    applied = list()
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            # Waiting for the lock and rewriting large tables may both outlast DB_STATEMENT_TIMEOUT_MS
+            cursor.execute("SET LOCAL statement_timeout = 0")
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version     TEXT PRIMARY KEY,
+                    applied_at  TIMESTAMP NOT NULL DEFAULT now()
+                )
+            """)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied_versions = {row[0] for row in cursor.fetchall()}
+            for version, path in get_migrations(directory):
+                if version in applied_versions:
+                    continue
+                logger.info(f"Applying migration {version}")
+                with open(path) as f:
+                    cursor.execute(f.read())
+                cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                applied.append(version)
+    return applied
+
+if __name__ == '__main__':
+    configure_logging()
+    versions = apply_migrations()
+    print(f"Applied migrations: {', '.join(versions)}" if versions else "Schema is up to date")
@@ -0,0 +1,25 @@
+-- Crawl runs with per-batch checkpoints and one parsed price per product and run
+
+CREATE TABLE IF NOT EXISTS crawl_runs (
+    id               SERIAL PRIMARY KEY,
+    etl_date         TIMESTAMP NOT NULL UNIQUE,
+    status           TEXT NOT NULL DEFAULT 'running',
+    last_product_id  INTEGER NOT NULL DEFAULT 0,
+    products_parsed  INTEGER NOT NULL DEFAULT 0,
+    products_failed  INTEGER NOT NULL DEFAULT 0,
+    started_at       TIMESTAMP NOT NULL DEFAULT now(),
+    updated_at       TIMESTAMP NOT NULL DEFAULT now(),
+    finished_at      TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS crawl_runs_status_idx ON crawl_runs (status, started_at);
+
+-- Reruns of the same etl_date used to append duplicates, keep the first row of each
+DELETE FROM parsed_products duplicate
+USING parsed_products original
+WHERE duplicate.product_id = original.product_id
+  AND duplicate.etl_date = original.etl_date
+  AND duplicate.id > original.id;
+
+ALTER TABLE parsed_products
+    ADD CONSTRAINT parsed_products_product_id_etl_date_key UNIQUE (product_id, etl_date);
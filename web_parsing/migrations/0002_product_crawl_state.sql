@@ -0,0 +1,38 @@
+-- Per product recrawl schedule, products are crawled when next_due_at has passed
+
+CREATE TABLE IF NOT EXISTS product_crawl_state (
+    product_id       INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    next_due_at      TIMESTAMP NOT NULL DEFAULT now(),
+    last_crawled_at  TIMESTAMP,
+    last_price       NUMERIC,
+    change_rate      DOUBLE PRECISION NOT NULL DEFAULT 0.5,
+    failure_count    INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS product_crawl_state_next_due_at_idx ON product_crawl_state (next_due_at);
+CREATE INDEX IF NOT EXISTS product_crawl_state_last_crawled_at_idx ON product_crawl_state (last_crawled_at);
+CREATE INDEX IF NOT EXISTS users_products_subscriptions_product_id_idx ON users_products_subscriptions (product_id);
+
+-- Seed the change rate from the last 30 days of history, every product is due right away
+INSERT INTO product_crawl_state (product_id, last_crawled_at, last_price, change_rate)
+SELECT
+    product_id,
+    max(etl_date),
+    (array_agg(price_proceeded ORDER BY etl_date DESC))[1],
+    COALESCE(avg(changed), 0.5)
+FROM (
+    SELECT
+        product_id,
+        etl_date,
+        price_proceeded,
+        CASE
+            WHEN lag(etl_date) OVER w IS NULL THEN NULL
+            WHEN price_proceeded IS DISTINCT FROM lag(price_proceeded) OVER w THEN 1.0
+            ELSE 0.0
+        END AS changed
+    FROM parsed_products
+    WHERE etl_date >= now() - interval '30 days'
+    WINDOW w AS (PARTITION BY product_id ORDER BY etl_date)
+) history
+GROUP BY product_id
+ON CONFLICT (product_id) DO NOTHING;
@@ -0,0 +1,54 @@
+-- Change-only price storage: a row covers every observation of its price
+-- from etl_date (first seen) until last_seen_at
+
+ALTER TABLE parsed_products ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP;
+UPDATE parsed_products SET last_seen_at = etl_date WHERE last_seen_at IS NULL;
+
+-- Compact existing history, consecutive observations of the same price
+-- collapse into their first row
+CREATE TEMP TABLE parsed_products_ranges ON COMMIT DROP AS
+SELECT
+    (array_agg(id ORDER BY etl_date))[1] AS keep_id,
+    max(etl_date) AS last_seen_at
+FROM (
+    SELECT
+        id,
+        product_id,
+        etl_date,
+        sum(is_change) OVER (PARTITION BY product_id ORDER BY etl_date) AS price_range
+    FROM (
+        SELECT
+            id,
+            product_id,
+            etl_date,
+            CASE
+                WHEN lag(etl_date) OVER w IS NOT NULL
+                 AND price_proceeded IS NOT DISTINCT FROM lag(price_proceeded) OVER w THEN 0
+                ELSE 1
+            END AS is_change
+        FROM parsed_products
+        WINDOW w AS (PARTITION BY product_id ORDER BY etl_date)
+    ) changes
+) ranges
+GROUP BY product_id, price_range;
+
+DELETE FROM parsed_products p
+WHERE NOT EXISTS (SELECT 1 FROM parsed_products_ranges r WHERE r.keep_id = p.id);
+
+UPDATE parsed_products p
+SET last_seen_at = r.last_seen_at
+FROM parsed_products_ranges r
+WHERE p.id = r.keep_id AND p.last_seen_at <> r.last_seen_at;
+
+ALTER TABLE parsed_products ALTER COLUMN last_seen_at SET NOT NULL;
+
+-- Observations expanded back onto the 6 hour crawl cadence plus the last
+-- observation, for readers expecting one row per crawl
+CREATE OR REPLACE VIEW price_observations AS
+SELECT p.product_id, o.etl_date, p.price_proceeded
+FROM parsed_products p
+CROSS JOIN LATERAL (
+    SELECT generate_series(p.etl_date, p.last_seen_at, interval '6 hours') AS etl_date
+    UNION
+    SELECT p.last_seen_at
+) o;
@@ -0,0 +1,11 @@
+-- Several crawl workers share product_crawl_state, a worker leases the
+-- products it crawls so nobody else picks them up until the lease expires
+
+ALTER TABLE product_crawl_state ADD COLUMN IF NOT EXISTS lease_owner TEXT;
+ALTER TABLE product_crawl_state ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+
+-- Every worker keeps its own crawl runs, runs of different workers may share an etl_date
+ALTER TABLE crawl_runs ADD COLUMN IF NOT EXISTS worker_id TEXT NOT NULL DEFAULT '';
+ALTER TABLE crawl_runs DROP CONSTRAINT IF EXISTS crawl_runs_etl_date_key;
+DROP INDEX IF EXISTS crawl_runs_status_idx;
+CREATE INDEX IF NOT EXISTS crawl_runs_worker_status_idx ON crawl_runs (worker_id, status, started_at);
@@ -0,0 +1,73 @@
+-- Monthly range partitions of parsed_products on etl_date, see
+-- web_parsing/partitions.py for creating upcoming months and retention
+
+CREATE OR REPLACE FUNCTION create_parsed_products_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    partition_start DATE := date_trunc('month', month);
+    partition_name TEXT := 'parsed_products_' || to_char(partition_start, 'YYYY_MM');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF parsed_products FOR VALUES FROM (%L) TO (%L)',
+        partition_name, partition_start, partition_start + interval '1 month'
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP VIEW IF EXISTS price_observations;
+
+ALTER TABLE parsed_products RENAME TO parsed_products_unpartitioned;
+ALTER SEQUENCE parsed_products_id_seq OWNED BY NONE;
+
+CREATE TABLE parsed_products (
+    id               INTEGER NOT NULL DEFAULT nextval('parsed_products_id_seq'),
+    product_id       INTEGER,
+    price_proceeded  NUMERIC,
+    etl_date         TIMESTAMP NOT NULL,
+    last_seen_at     TIMESTAMP NOT NULL,
+    CONSTRAINT fk_product FOREIGN KEY (product_id) REFERENCES products(id)
+) PARTITION BY RANGE (etl_date);
+
+ALTER SEQUENCE parsed_products_id_seq OWNED BY parsed_products.id;
+
+-- Every month with data up to two months ahead, the default partition
+-- only catches dates outside of them
+SELECT create_parsed_products_partition(month::date)
+FROM generate_series(
+    date_trunc('month', LEAST((SELECT min(etl_date) FROM parsed_products_unpartitioned), now())),
+    date_trunc('month', now()) + interval '2 months',
+    interval '1 month'
+) month;
+
+CREATE TABLE parsed_products_default PARTITION OF parsed_products DEFAULT;
+
+-- Rows without an etl_date can't be placed in time and never showed up in any read
+INSERT INTO parsed_products (id, product_id, price_proceeded, etl_date, last_seen_at)
+SELECT id, product_id, price_proceeded, etl_date, last_seen_at
+FROM parsed_products_unpartitioned
+WHERE etl_date IS NOT NULL;
+
+DROP TABLE parsed_products_unpartitioned;
+
+-- Constraints and indexes are built after the copy, once per partition
+ALTER TABLE parsed_products ADD CONSTRAINT parsed_products_pkey PRIMARY KEY (id, etl_date);
+
+-- Every read filters on product_id and orders by etl_date, in either
+-- direction. The remaining columns are included, so those reads are
+-- answered from the index alone.
+ALTER TABLE parsed_products
+    ADD CONSTRAINT parsed_products_product_id_etl_date_key UNIQUE (product_id, etl_date)
+    INCLUDE (price_proceeded, last_seen_at, id);
+
+CREATE INDEX parsed_products_etl_date_brin ON parsed_products USING brin (etl_date);
+
+CREATE VIEW price_observations AS
+SELECT p.product_id, o.etl_date, p.price_proceeded
+FROM parsed_products p
+CROSS JOIN LATERAL (
+    SELECT generate_series(p.etl_date, p.last_seen_at, interval '6 hours') AS etl_date
+    UNION
+    SELECT p.last_seen_at
+) o;
+
+ANALYZE parsed_products;
@@ -0,0 +1,26 @@
+-- Sufficient statistics of every product's prediction model, a prediction
+-- run folds in the observations after last_date only, see
+-- web_parsing/model_state.py
+
+CREATE TABLE IF NOT EXISTS product_model_state (
+    product_id         INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    -- t of the features counts days from the first kept observation
+    first_date         TIMESTAMP,
+    last_date          TIMESTAMP NOT NULL,
+    observations       INTEGER NOT NULL,
+    -- Count, sum and sum of squares of every price seen, for the outlier filter
+    price_count        INTEGER NOT NULL,
+    price_sum          DOUBLE PRECISION NOT NULL,
+    price_sum_squares  DOUBLE PRECISION NOT NULL,
+    -- Training rows of the Ridge: their count, the sums of the features
+    -- (t, dow, lag1, ma7) and of the price, X^T X row by row and X^T y
+    training_rows      INTEGER NOT NULL,
+    feature_sums       DOUBLE PRECISION[] NOT NULL,
+    target_sum         DOUBLE PRECISION NOT NULL,
+    gram               DOUBLE PRECISION[] NOT NULL,
+    moments            DOUBLE PRECISION[] NOT NULL,
+    -- The kept observations lag1 and ma7 of the next rows and the next prediction look back on
+    recent_dates       TIMESTAMP[] NOT NULL,
+    recent_prices      DOUBLE PRECISION[] NOT NULL,
+    updated_at         TIMESTAMP NOT NULL DEFAULT now()
+);
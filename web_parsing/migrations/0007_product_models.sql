@@ -0,0 +1,17 @@
+-- The fitted prediction model of every product with enough history, a
+-- prediction for any horizon needs this row only, see
+-- web_parsing/model_store.py
+
+CREATE TABLE IF NOT EXISTS product_models (
+    product_id      INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    -- Ridge coefficients of t, dow, lag1 and ma7
+    coefficients    DOUBLE PRECISION[] NOT NULL,
+    intercept       DOUBLE PRECISION NOT NULL,
+    -- t counts days from first_date, predictions count days ahead from last_date
+    first_date      TIMESTAMP NOT NULL,
+    last_date       TIMESTAMP NOT NULL,
+    -- lag1 and ma7 of every prediction
+    last_price      DOUBLE PRECISION NOT NULL,
+    recent_average  DOUBLE PRECISION NOT NULL,
+    trained_at      TIMESTAMP NOT NULL
+);
@@ -0,0 +1,11 @@
+-- Every prediction keeps the fingerprint of the history it was made from,
+-- the prediction job skips products whose fingerprint did not change
+
+ALTER TABLE product_price_predictions ADD COLUMN IF NOT EXISTS history_rows INTEGER;
+ALTER TABLE product_price_predictions ADD COLUMN IF NOT EXISTS history_last_seen_at TIMESTAMP;
+ALTER TABLE product_price_predictions ADD COLUMN IF NOT EXISTS history_last_price NUMERIC;
+
+-- The latest prediction of a product, with its fingerprint, from the index alone
+CREATE INDEX IF NOT EXISTS product_price_predictions_product_id_etl_date_idx
+    ON product_price_predictions (product_id, etl_date)
+    INCLUDE (history_rows, history_last_seen_at, history_last_price);
@@ -0,0 +1,22 @@
+-- price_observations exposes the crawls that actually happened: the first
+-- and the last observation of every price range, a price holds until the
+-- next observation. The prediction model resamples this step function
+-- onto its own grid, see resample_histories in web_parsing/batch_prediction.py.
+-- Two plain branches instead of a lateral series, so filters on
+-- product_id and etl_date reach the parsed_products index.
+
+CREATE OR REPLACE VIEW price_observations AS
+SELECT product_id, etl_date, price_proceeded
+FROM parsed_products
+UNION ALL
+SELECT product_id, last_seen_at, price_proceeded
+FROM parsed_products
+WHERE last_seen_at > etl_date;
+
+-- Model states and models were built on the old 6 hour series, the next
+-- prediction run rebuilds them from the whole history
+TRUNCATE product_model_state, product_models;
+
+-- The price in effect at last_date before the outlier filter, the grid
+-- points after last_date keep it until the next observation
+ALTER TABLE product_model_state ADD COLUMN IF NOT EXISTS last_price DOUBLE PRECISION;
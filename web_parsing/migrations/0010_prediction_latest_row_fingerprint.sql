@@ -0,0 +1,8 @@
+-- The fingerprint of a history is its latest parsed_products row, one
+-- entry of the (product_id, etl_date) index. Counting the rows of every
+-- history took a scan of the whole table per prediction run.
+DROP INDEX IF EXISTS product_price_predictions_product_id_etl_date_idx;
+ALTER TABLE product_price_predictions DROP COLUMN IF EXISTS history_rows;
+CREATE INDEX IF NOT EXISTS product_price_predictions_product_id_etl_date_idx
+    ON product_price_predictions (product_id, etl_date)
+    INCLUDE (history_last_seen_at, history_last_price);
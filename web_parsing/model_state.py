@@ -0,0 +1,216 @@
+import numpy as np
+from .batch_prediction import (
+    MIN_HISTORY, MIN_TRAINING_ROWS, MOVING_AVERAGE_WINDOW, NANOSECONDS_PER_DAY, NO_DATE, OUTLIER_SIGMAS, RIDGE_ALPHA,
+    build_features, build_future_features, compact_rows, get_last_observations, resample_histories, solve_ridge
+)
+
+FEATURE_COUNT = 4
+# Relative rounding error of prices averaged from sums
+PRICE_TOLERANCE = 1e-9
+
+class ModelStates:
+    """Sufficient statistics of the prediction Ridge for many products.
+
+    Instead of the history itself a product keeps the sums, X^T X
+    (``gram``) and X^T y (``moments``) of its training rows, the price
+    statistics of the outlier filter (over every price seen, like
+    ``preprocess`` computes them) and its most recent kept
+    observations (``recent_*``, padded with NaN prices), which ``lag1`` and
+    ``ma7`` of the next rows and the next prediction need. Observations
+    are the points of the ``resample_histories`` grid. Dates are int64
+    nanoseconds, ``last_dates`` is the last grid point folded in so far
+    and ``last_prices`` the price in effect there, before the outlier
+    filter. ``product_ids`` are sorted.
+    """
+
+    def __init__(self, product_ids, first_dates, last_dates, last_prices, observations, price_counts, price_sums,
+                 price_sums_squares, training_rows, feature_sums, target_sums, gram, moments,
+                 recent_dates, recent_prices, recent_lengths):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.first_dates = np.asarray(first_dates, dtype=np.int64)
+        self.last_dates = np.asarray(last_dates, dtype=np.int64)
+        self.last_prices = np.asarray(last_prices, dtype=float)
+        self.observations = np.asarray(observations, dtype=np.int64)
+        self.price_counts = np.asarray(price_counts, dtype=np.int64)
+        self.price_sums = np.asarray(price_sums, dtype=float)
+        self.price_sums_squares = np.asarray(price_sums_squares, dtype=float)
+        self.training_rows = np.asarray(training_rows, dtype=np.int64)
+        self.feature_sums = np.asarray(feature_sums, dtype=float).reshape(-1, FEATURE_COUNT)
+        self.target_sums = np.asarray(target_sums, dtype=float)
+        self.gram = np.asarray(gram, dtype=float).reshape(-1, FEATURE_COUNT, FEATURE_COUNT)
+        self.moments = np.asarray(moments, dtype=float).reshape(-1, FEATURE_COUNT)
+        self.recent_dates = np.asarray(recent_dates, dtype=np.int64)
+        self.recent_prices = np.asarray(recent_prices, dtype=float)
+        self.recent_lengths = np.asarray(recent_lengths, dtype=np.int64)
+
+    @classmethod
+    def empty(cls, product_ids):
+        """States of products nothing was folded into yet"""
+        count = len(product_ids)
+        return cls(
+            np.sort(np.asarray(product_ids, dtype=np.int64)), np.full(count, NO_DATE), np.full(count, NO_DATE),
+            np.full(count, np.nan), np.zeros(count), np.zeros(count), np.zeros(count), np.zeros(count), np.zeros(count),
+            np.zeros((count, FEATURE_COUNT)), np.zeros(count), np.zeros((count, FEATURE_COUNT, FEATURE_COUNT)),
+            np.zeros((count, FEATURE_COUNT)), np.zeros((count, 0)), np.zeros((count, 0)), np.zeros(count)
+        )
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def set_recent(self, positions, dates, prices, lengths):
+        """Replace the recent observations of the products at ``positions``, widening the padding if needed"""
+        width = max(self.recent_prices.shape[1], dates.shape[1])
+        if width > self.recent_prices.shape[1]:
+            padding = width - self.recent_prices.shape[1]
+            self.recent_dates = np.pad(self.recent_dates, ((0, 0), (0, padding)))
+            self.recent_prices = np.pad(self.recent_prices, ((0, 0), (0, padding)), constant_values=np.nan)
+        padding = ((0, 0), (0, width - dates.shape[1]))
+        self.recent_dates[positions] = np.pad(dates, padding)
+        self.recent_prices[positions] = np.pad(prices, padding, constant_values=np.nan)
+        self.recent_lengths[positions] = lengths
+
+def filter_new_prices(states, positions, prices, sigmas=OUTLIER_SIGMAS):
+    """Keep mask of new observations, ``preprocess`` with the statistics of every price seen so far.
+
+    The price statistics of ``states`` must already include ``prices``. A
+    whole history folded at once is filtered exactly like ``preprocess``
+    does. Folded in slices it is an approximation: every slice is filtered
+    against the history up to its end, and earlier decisions are not
+    revisited when later prices move the bounds. Undoing them would need
+    the whole history, which the states don't keep. A few percent of the
+    products end up more than 1% away from a full refit (see
+    benchmarks/incremental_model), the nightly full rebuild of the
+    scheduler resets them.
+    """
+    counts = states.price_counts[positions].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = states.price_sums[positions] / counts
+        variance = (states.price_sums_squares[positions] - counts * mean ** 2) / (counts - 1)
+        sigma = np.sqrt(np.maximum(variance, 0.0))
+        # The sums lose the spread of constant prices to rounding, a price at the mean is inside whatever sigma is
+        bounds = sigmas * sigma + np.abs(mean) * PRICE_TOLERANCE
+        inside_bounds = np.abs(prices - mean[:, None]) <= bounds[:, None]
+    # A single price has no sigma yet, rejecting it would lose the first observation for good
+    return inside_bounds | (counts < 2)[:, None] & ~np.isnan(prices)
+
+def fold_histories(states, histories, outlier_sigmas=OUTLIER_SIGMAS):
+    """Fold the observations of ``histories`` (newer than ``states.last_dates``) into ``states``.
+
+    The observations are resampled onto the grid points after
+    ``last_dates``, up to the last observation. Those after the last grid
+    point are read again by the next fold. Works on the products of
+    ``histories`` only, at a cost proportional to their new rows.
+    ``states`` are updated in place and returned.
+    """
+    if not len(histories):
+        return states
+    positions = np.searchsorted(states.product_ids, histories.product_ids)
+    histories = resample_histories(histories, states.last_dates[positions], states.last_prices[positions])
+    if not len(histories):
+        return states
+    positions = np.searchsorted(states.product_ids, histories.product_ids)
+    rows = np.arange(len(positions))
+    new_dates, new_prices, new_lengths = histories.to_padded()
+    states.observations[positions] += new_lengths
+    states.last_dates[positions] = new_dates[rows, new_lengths - 1]
+    states.last_prices[positions] = new_prices[rows, new_lengths - 1]
+
+    states.price_counts[positions] += (~np.isnan(new_prices)).sum(axis=1)
+    states.price_sums[positions] += np.nansum(new_prices, axis=1)
+    states.price_sums_squares[positions] += np.nansum(new_prices ** 2, axis=1)
+    keep = filter_new_prices(states, positions, new_prices, outlier_sigmas)
+    new_dates, new_prices, new_lengths = compact_rows(new_dates, new_prices, keep)
+
+    # Recent observations first, the new ones right after them
+    context_lengths = states.recent_lengths[positions]
+    context_width = states.recent_prices.shape[1]
+    dates = np.concatenate([states.recent_dates[positions], new_dates], axis=1)
+    prices = np.concatenate([states.recent_prices[positions], new_prices], axis=1)
+    columns = np.arange(dates.shape[1])
+    keep = (columns < context_lengths[:, None]) | ((columns >= context_width) & (columns - context_width < new_lengths[:, None]))
+    dates, prices, lengths = compact_rows(dates, prices, keep)
+    # At least one column, even when every price so far was filtered out
+    width = max(int(lengths.max()), 1)
+    dates, prices = dates[:, :width], prices[:, :width]
+
+    first_dates = states.first_dates[positions]
+    first_dates = np.where((first_dates == NO_DATE) & (lengths > 0), dates[:, 0], first_dates)
+    states.first_dates[positions] = first_dates
+    X, y, mask = build_features(dates, prices, lengths, first_dates, context_lengths)
+    weights = mask.astype(float)
+    states.training_rows[positions] += mask.sum(axis=1)
+    states.feature_sums[positions] += np.einsum('pr,prf->pf', weights, X)
+    states.target_sums[positions] += y.sum(axis=1)
+    states.gram[positions] += np.einsum('prf,prg->pfg', X * weights[:, :, None], X)
+    states.moments[positions] += np.einsum('prf,pr->pf', X * weights[:, :, None], y)
+
+    # The rows lag1 and ma7 of the next rows look back on, and the last week for the next prediction
+    last_dates = dates[rows, np.maximum(lengths - 1, 0)]
+    recent = (columns[:width] < lengths[:, None]) & (
+        (columns[:width] >= (lengths - (MOVING_AVERAGE_WINDOW - 1))[:, None])
+        | (dates > (last_dates - MOVING_AVERAGE_WINDOW * NANOSECONDS_PER_DAY)[:, None])
+    )
+    dates, prices, lengths = compact_rows(dates, prices, recent)
+    width = int(lengths.max())
+    states.set_recent(positions, dates[:, :width], prices[:, :width], lengths)
+    return states
+
+class ProductModels:
+    """Fitted Ridge of many products with everything a prediction for any horizon needs.
+
+    Dates are int64 nanoseconds: ``first_dates`` is where ``t`` counts
+    from, ``last_dates`` the last kept observation, whose price
+    (``last_prices``) is the lag and ``recent_averages`` the moving average
+    of every prediction.
+    """
+
+    def __init__(self, product_ids, first_dates, last_dates, coefficients, intercepts, last_prices, recent_averages):
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.first_dates = np.asarray(first_dates, dtype=np.int64)
+        self.last_dates = np.asarray(last_dates, dtype=np.int64)
+        self.coefficients = np.asarray(coefficients, dtype=float).reshape(-1, FEATURE_COUNT)
+        self.intercepts = np.asarray(intercepts, dtype=float)
+        self.last_prices = np.asarray(last_prices, dtype=float)
+        self.recent_averages = np.asarray(recent_averages, dtype=float)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def select(self, positions):
+        """Models of the products at ``positions`` only"""
+        return ProductModels(
+            self.product_ids[positions], self.first_dates[positions], self.last_dates[positions],
+            self.coefficients[positions], self.intercepts[positions], self.last_prices[positions],
+            self.recent_averages[positions]
+        )
+
+    def predict(self, days_ahead=30):
+        """(predicted prices, change indexes) ``days_ahead`` days past the last observation"""
+        X_new = build_future_features(self.first_dates, self.last_dates, self.last_prices, self.recent_averages, days_ahead)
+        predicted = np.einsum('pf,pf->p', X_new, self.coefficients) + self.intercepts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = (predicted - self.last_prices) / self.last_prices * 100
+        return predicted, change
+
+def fit_models(states, alpha=RIDGE_ALPHA):
+    """ProductModels of the products with enough history"""
+    eligible = np.flatnonzero((states.observations >= MIN_HISTORY) & (states.training_rows >= MIN_TRAINING_ROWS))
+    if not len(eligible):
+        return ProductModels([], [], [], np.zeros((0, FEATURE_COUNT)), [], [], [])
+    coefficients, intercepts = solve_ridge(
+        states.training_rows[eligible].astype(float), states.feature_sums[eligible], states.target_sums[eligible],
+        states.gram[eligible], states.moments[eligible], alpha
+    )
+    last_dates, last_prices, recent_averages = get_last_observations(
+        states.recent_dates[eligible], states.recent_prices[eligible], states.recent_lengths[eligible]
+    )
+    return ProductModels(
+        states.product_ids[eligible], states.first_dates[eligible], last_dates, coefficients, intercepts,
+        last_prices, recent_averages
+    )
+
+def predict_states(states, days_ahead=30, alpha=RIDGE_ALPHA):
+    """``predict_batch`` from model states, returns (product ids, predicted prices, change indexes)"""
+    models = fit_models(states, alpha)
+    predicted, change = models.predict(days_ahead)
+    return models.product_ids, predicted, change
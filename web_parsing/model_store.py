@@ -0,0 +1,207 @@
+import numpy as np
+from .batch_prediction import PriceHistories
+from .bulk_writer import upsert_rows
+from .db import pooled_connection
+from .model_state import FEATURE_COUNT, NO_DATE, ModelStates, ProductModels, fit_models, fold_histories
+
+HISTORY_FETCH_SIZE = 20000
+
+def read_price_histories(conn, query, params, fetch_size=HISTORY_FETCH_SIZE):
+    """PriceHistories of ``query`` rows (product_id, microseconds since the epoch, price) in product order.
+
+    Rows stream through a server-side cursor and are split per product
+    with offset arrays.
+    """
+    ids, dates, prices = [], [], []
+    with conn.cursor(name="price_history_cursor") as cur:
+        cur.itersize = fetch_size
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            batch_ids, batch_dates, batch_prices = zip(*rows)
+            ids.extend(batch_ids)
+            dates.extend(batch_dates)
+            prices.extend(batch_prices)
+    ids    = np.array(ids, dtype=np.int64)
+    # Timestamps arrive as microseconds since the epoch, cheaper to parse than datetimes
+    dates  = np.array(dates, dtype=np.int64).astype('datetime64[us]').astype('datetime64[ns]')
+    prices = np.array(prices, dtype=float)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.array([], dtype=np.int64)
+    ends   = np.r_[starts[1:], len(ids)]
+    return PriceHistories(ids[starts], dates, prices, starts, ends)
+
+MODEL_STATE_COLUMNS = [
+    'product_id', 'first_date', 'last_date', 'last_price', 'observations', 'price_count', 'price_sum', 'price_sum_squares',
+    'training_rows', 'feature_sums', 'target_sum', 'gram', 'moments', 'recent_dates', 'recent_prices', 'updated_at'
+]
+
+def to_datetimes(dates):
+    """Python datetimes (None for NO_DATE) of int64 nanosecond dates"""
+    return np.asarray(dates, dtype=np.int64).astype('datetime64[ns]').astype('datetime64[us]').tolist()
+
+def load_model_states(conn, product_ids):
+    """Stored states of ``product_ids``, locked until ``conn`` commits. Products without one start empty."""
+    states = ModelStates.empty(product_ids)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                product_id,
+                (extract(epoch FROM first_date) * 1000000)::int8,
+                (extract(epoch FROM last_date) * 1000000)::int8,
+                last_price, observations, price_count, price_sum, price_sum_squares,
+                training_rows, feature_sums, target_sum, gram, moments,
+                ARRAY(
+                    SELECT (extract(epoch FROM recent.date) * 1000000)::int8
+                    FROM unnest(recent_dates) WITH ORDINALITY recent(date, position)
+                    ORDER BY recent.position
+                ),
+                recent_prices
+            FROM product_model_state
+            WHERE product_id = ANY(%s)
+            FOR UPDATE
+        """, (list(product_ids),))
+        rows = cur.fetchall()
+    if not rows:
+        return states
+    (ids, first_dates, last_dates, last_prices, observations, price_counts, price_sums, price_sums_squares,
+     training_rows, feature_sums, target_sums, gram, moments, recent_dates, recent_prices) = zip(*rows)
+    positions = np.searchsorted(states.product_ids, np.array(ids, dtype=np.int64))
+    states.first_dates[positions] = [NO_DATE if date is None else date * 1000 for date in first_dates]
+    states.last_dates[positions] = np.array(last_dates, dtype=np.int64) * 1000
+    states.last_prices[positions] = np.array(last_prices, dtype=float)
+    states.observations[positions] = observations
+    states.price_counts[positions] = price_counts
+    states.price_sums[positions] = price_sums
+    states.price_sums_squares[positions] = price_sums_squares
+    states.training_rows[positions] = training_rows
+    states.feature_sums[positions] = feature_sums
+    states.target_sums[positions] = target_sums
+    states.gram[positions] = np.array(gram, dtype=float).reshape(-1, *states.gram.shape[1:])
+    states.moments[positions] = moments
+    lengths = np.array([len(dates) for dates in recent_dates], dtype=np.int64)
+    padded_dates = np.zeros((len(rows), int(lengths.max())), dtype=np.int64)
+    padded_prices = np.full((len(rows), int(lengths.max())), np.nan)
+    for row, (dates, prices) in enumerate(zip(recent_dates, recent_prices)):
+        padded_dates[row, :len(dates)] = np.array(dates, dtype=np.int64) * 1000
+        padded_prices[row, :len(prices)] = prices
+    states.set_recent(positions, padded_dates, padded_prices, lengths)
+    return states
+
+def load_new_price_histories(conn, states, fetch_size=HISTORY_FETCH_SIZE):
+    """Observations of every product after its ``states.last_dates``, the whole history for new states.
+
+    Reads the price_observations view like load_price_histories does, so
+    incremental and full histories always come from the same definition.
+    """
+    # OFFSET 0 keeps the lateral subquery a per-product index lookup, the
+    # planner would rather merge the whole view with the product list
+    return read_price_histories(conn, """
+        SELECT s.product_id, (extract(epoch FROM o.etl_date) * 1000000)::int8, o.price_proceeded::float8
+        FROM unnest(%s::int[], %s::timestamp[]) AS s(product_id, last_date)
+        CROSS JOIN LATERAL (
+            SELECT etl_date, price_proceeded
+            FROM price_observations
+            WHERE product_id = s.product_id
+              AND etl_date > COALESCE(s.last_date, '-infinity')
+            OFFSET 0
+        ) o
+        ORDER BY s.product_id, o.etl_date
+    """, (states.product_ids.tolist(), to_datetimes(states.last_dates)), fetch_size)
+
+def save_model_states(conn, states, positions, now):
+    """Upsert the states of the products at ``positions``"""
+    first_dates = to_datetimes(states.first_dates[positions])
+    last_dates = to_datetimes(states.last_dates[positions])
+    rows = (
+        (
+            int(states.product_ids[position]), first_date, last_date, float(states.last_prices[position]),
+            int(states.observations[position]),
+            int(states.price_counts[position]), float(states.price_sums[position]),
+            float(states.price_sums_squares[position]), int(states.training_rows[position]),
+            states.feature_sums[position].tolist(), float(states.target_sums[position]),
+            states.gram[position].ravel().tolist(), states.moments[position].tolist(),
+            to_datetimes(states.recent_dates[position, :states.recent_lengths[position]]),
+            states.recent_prices[position, :states.recent_lengths[position]].tolist(), now
+        )
+        for position, first_date, last_date in zip(positions, first_dates, last_dates)
+    )
+    with conn.cursor() as cur:
+        return upsert_rows(cur, 'product_model_state', MODEL_STATE_COLUMNS, rows, conflict_columns=['product_id'])
+
+PRODUCT_MODEL_COLUMNS = [
+    'product_id', 'coefficients', 'intercept', 'first_date', 'last_date', 'last_price', 'recent_average', 'trained_at'
+]
+
+def save_product_models(conn, models, now):
+    """Upsert ``models`` into product_models"""
+    first_dates = to_datetimes(models.first_dates)
+    last_dates = to_datetimes(models.last_dates)
+    rows = (
+        (
+            int(models.product_ids[position]), models.coefficients[position].tolist(),
+            float(models.intercepts[position]), first_dates[position], last_dates[position],
+            float(models.last_prices[position]), float(models.recent_averages[position]), now
+        )
+        for position in range(len(models))
+    )
+    with conn.cursor() as cur:
+        return upsert_rows(cur, 'product_models', PRODUCT_MODEL_COLUMNS, rows, conflict_columns=['product_id'])
+
+def load_product_models(conn, product_ids):
+    """Stored ProductModels of ``product_ids``, products without a model are left out"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                product_id,
+                (extract(epoch FROM first_date) * 1000000)::int8,
+                (extract(epoch FROM last_date) * 1000000)::int8,
+                coefficients, intercept, last_price, recent_average
+            FROM product_models
+            WHERE product_id = ANY(%s)
+            ORDER BY product_id
+        """, (list(product_ids),))
+        rows = cur.fetchall()
+    if not rows:
+        return ProductModels([], [], [], np.zeros((0, FEATURE_COUNT)), [], [], [])
+    ids, first_dates, last_dates, coefficients, intercepts, last_prices, recent_averages = zip(*rows)
+    return ProductModels(
+        ids, np.array(first_dates, dtype=np.int64) * 1000, np.array(last_dates, dtype=np.int64) * 1000,
+        coefficients, intercepts, last_prices, recent_averages
+    )
+
+def train_models(product_ids, now, rebuild=False):
+    """Fold the new observations of ``product_ids`` into their stored states and refit their models.
+
+    States and models are saved in one transaction, the returned
+    ProductModels cover the products with enough history. With
+    ``rebuild`` the stored states are ignored and rebuilt from the whole
+    history.
+    """
+    with pooled_connection() as conn:
+        states = ModelStates.empty(product_ids) if rebuild else load_model_states(conn, product_ids)
+        histories = load_new_price_histories(conn, states)
+        fold_histories(states, histories)
+        # A history that doesn't reach a grid point yet leaves a new state empty, it is read again next run
+        positions = np.searchsorted(states.product_ids, histories.product_ids)
+        save_model_states(conn, states, positions[states.last_dates[positions] != NO_DATE], now)
+        models = fit_models(states)
+        # Models of products without new observations did not change
+        save_product_models(conn, models.select(np.flatnonzero(np.isin(models.product_ids, histories.product_ids))), now)
+    return models
+
+def get_product_model(product_id):
+    """ProductModels of one product, read only (empty without enough history).
+
+    The stored model when there is one, otherwise a model fitted in memory
+    from the whole history. Nothing is locked or written, the prediction
+    job stays the only writer of states and models.
+    """
+    with pooled_connection() as conn:
+        models = load_product_models(conn, [product_id])
+        if len(models):
+            return models
+        states = ModelStates.empty([product_id])
+        fold_histories(states, load_new_price_histories(conn, states))
+    return fit_models(states)
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import sqlite3
+import time
+from .product import Product
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'page_cache.sqlite')
+DEFAULT_MAX_ENTRIES = 100000
+
+def hash_content(content):
+    return hashlib.sha256(content).hexdigest()
+
+class CachedPage:
+    def __init__(self, url, etag, last_modified, content_hash, config_fingerprint, marketplace_key, name, price, currency, structured_price):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.config_fingerprint = config_fingerprint
+        self.marketplace_key = marketplace_key
+        self.name = name
+        self.price = price
+        self.currency = currency
+        self.structured_price = bool(structured_price)
+
+    def get_conditional_headers(self):
+        headers = dict()
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_product(self):
+        product = Product()
+        product.set_marketplace_key(self.marketplace_key)
+        product.set_name(self.name)
+        product.set_price(self.price)
+        product.set_currency(self.currency)
+        product.set_structured_price(self.structured_price)
+        return product
+
+class PageCache:
+    """On-disk cache of page validators and the product values extracted from the page.
+
+    Entries are keyed by URL. Once the cache holds more than ``max_entries``
+    pages the least recently used ones are evicted on ``flush``.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.getenv('PAGE_CACHE_PATH', DEFAULT_CACHE_PATH)
+        self.max_entries = max_entries or int(os.getenv('PAGE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                config_fingerprint TEXT NOT NULL,
+                marketplace_key TEXT,
+                name TEXT,
+                price TEXT,
+                currency TEXT,
+                structured_price INTEGER,
+                last_used REAL NOT NULL
+            )
+        """)
+        # Caches written before prices were kept as page text hold normalized prices, which normalize again unchanged
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(pages)")}
+        if 'structured_price' not in columns:
+            self.connection.execute("ALTER TABLE pages ADD COLUMN structured_price INTEGER")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_last_used_idx ON pages (last_used)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, url):
+        row = self.connection.execute(
+            "SELECT url, etag, last_modified, content_hash, config_fingerprint, marketplace_key, name, price, currency, structured_price "
+            "FROM pages WHERE url = ?",
+            (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        return CachedPage(*row)
+
+    def touch(self, url, etag=None, last_modified=None):
+        """Mark a page as used again, keeping validators the server did not resend"""
+        self.connection.execute(
+            "UPDATE pages SET last_used = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) "
+            "WHERE url = ?",
+            (time.time(), etag, last_modified, url)
+        )
+
+    def put(self, url, etag, last_modified, content_hash, config_fingerprint, product):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages "
+            "(url, etag, last_modified, content_hash, config_fingerprint, marketplace_key, name, price, currency, structured_price, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                url, etag, last_modified, content_hash, config_fingerprint,
+                product.get_marketplace_key(), product.get_name(), product.get_price(), product.get_currency(),
+                product.get_structured_price(), time.time()
+            )
+        )
+
+    def flush(self):
+        """Commit pending writes and evict the least recently used pages over the limit"""
+        count = self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+        self.connection.commit()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
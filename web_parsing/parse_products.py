@@ -1,17 +1,31 @@
 from .configuration_loader import ConfigurationLoader
 from .marketplace_parser import MarketplaceParser
+from .async_fetcher import AsyncFetcher
+from .page_cache import PageCache
+from .extraction_pool import create_extraction_pool
+from .db import pooled_connection
+from .price_storage import write_price_observations
+from .price_normalization import normalize_prices
+from .crawl_runs import start_or_resume_run, checkpoint_run, finish_run, get_worker_id
+from .migrate import apply_migrations
+from .partitions import maintain_partitions
+from .recrawl_scheduler import RecrawlPolicy, ensure_crawl_state, get_hourly_budget, get_remaining_budget, claim_due_products, update_crawl_state
 from .product import Product
-from sqlalchemy import create_engine
 from datetime import datetime
 import datetime
-import psycopg2
 import pandas as pd
 import csv
 import re
 import time
 import schedule
 import os
-from .utils import get_db_url
+import logging
+from .tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK_MINUTES = 15
+DEFAULT_BATCH_SIZE = 1000
 
 class ParsingObject:
     def __init__(self, guid, marketplace_key, url, etl_date):
@@ -20,28 +34,10 @@ class ParsingObject:
         self.url = url
         self.etl_date = etl_date
 
-def get_db_connection():
-    return psycopg2.connect(
-        dbname   = os.getenv("DB_NAME",     "parse_db"),
-        user     = os.getenv("DB_USER",     "parser"),
-        password = os.getenv("DB_PASSWORD", "123456"),
-        host     = os.getenv("DB_HOST",     "localhost"),
-        port     = os.getenv("DB_PORT",     "5432")
-    )
-
-def get_sqlalchemy_engine():
-    db_user = os.getenv("DB_USER", "parser")
-    db_pass = os.getenv("DB_PASSWORD", "123456")
-    db_host = os.getenv("DB_HOST", "localhost")
-    db_port = os.getenv("DB_PORT", "5432")
-    db_name = os.getenv("DB_NAME", "parse_db")
-
-    url = f"postgresql+psycopg2://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
-    return create_engine(url)
-
-def insert_data_to_db(df, table_name='parsed_products'):
-    engine = get_sqlalchemy_engine()
-    df.to_sql(table_name, engine, if_exists='append', index=False, method='multi')
+def insert_data_to_db(df):
+    with pooled_connection() as conn:
+        with conn.cursor() as cursor:
+            write_price_observations(cursor, df.itertuples(index=False, name=None))
 
 def load_data_from_csv(path='data/data.csv'):
     parsing_objects_list = list()
@@ -51,96 +47,125 @@ def load_data_from_csv(path='data/data.csv'):
             parsing_objects_list.append(ParsingObject(row['guid'], row['marketplace_key'], row['url']))
     return parsing_objects_list
 
-def parse_and_transform_data(parsing_objects):
-    config = ConfigurationLoader(
-        get_db_url()
-    ).get_configuration_object()
-    parser = MarketplaceParser(config)
+def parse_and_transform_data(parsing_objects, fetcher=None):
     products = []
-    for object in parsing_objects:
-        print(f"[DEBUG] Parsing product: id={object.guid}, url={object.url}")
-        try:
-            product = parser.parse_product_by_url(object.url)
-            product.set_id(object.guid)
-            product.set_etl_date(object.etl_date)
-            print(f"[DEBUG] Parsed price (raw): {product._price}")
-        except Exception as e:
-            print(f"[DEBUG] Exception for url {object.url}: {e}")
+    logger.debug("Fetching %s products concurrently", len(parsing_objects))
+    if fetcher is None:
+        config = ConfigurationLoader().get_configuration_object()
+        with MarketplaceParser(config) as parser:
+            results = AsyncFetcher(parser).fetch_all(parsing_objects)
+    else:
+        parser = fetcher.parser
+        results = fetcher.fetch_all(parsing_objects)
+    for object, result in results:
+        if isinstance(result, Exception):
+            logger.warning("Failed to parse %s: %s", object.url, result)
             continue
+        product = result
+        product.set_id(object.guid)
+        product.set_etl_date(object.etl_date)
         product_object = {
             'product_id': product._id,
             'price': product._price,
+            'price_locale': parser.get_price_locale(product),
             'etl_date': product._etl_date
         }
         products.append(product_object)
     df = pd.DataFrame(products)
     if df.empty:
-        print("[DEBUG] No products parsed into DataFrame.")
+        logger.debug("No products parsed into DataFrame")
         return None
-    def debug_extract_price(raw):
-        price = extract_price(raw)
-        print(f"[DEBUG] Extracting price: raw='{raw}' -> price={price}")
-        return price
-    df['price_proceeded'] = df['price'].apply(debug_extract_price)
-    df = df.drop(columns=['price'])
+    # Raw page text, normalized once for the whole batch in the locale of every row
+    df['price_proceeded'] = normalize_prices(df['price'], df['price_locale'])
+    df = df.drop(columns=['price', 'price_locale'])
     desired_order = ['product_id', 'price_proceeded', 'etl_date']
     df = df[desired_order]
     return df
 
-
-def extract_price(raw):
-    if pd.isna(raw):
+def open_page_cache():
+    if os.getenv('PAGE_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
         return None
-    
-    text = str(raw).replace('\u00A0', '').strip()
-
-    number_text = re.sub(r'[^\d.,]', '', text)
-
-    if number_text.count(',') > 1:
-        number_text = number_text.replace(',', '')
-    elif number_text.count(',') == 1 and number_text.count('.') == 0:
-        number_text = number_text.replace(',', '.')
-    else:
-        number_text = re.sub(r'(?<=\d)[\s,](?=\d{3}\b)', '', number_text)
-    
-    try:
-        price = float(number_text)
-    except ValueError:
-        price = None
-
-    return price
+    return PageCache()
 
 def main():
-    conn = get_db_connection()
+    apply_migrations()
+    config = ConfigurationLoader().get_configuration_object()
+    parser = MarketplaceParser(config)
+    page_cache = open_page_cache()
+    extraction_pool = create_extraction_pool(config)
+    fetcher = AsyncFetcher(parser, page_cache=page_cache, executor=extraction_pool)
+    policy = RecrawlPolicy()
+    hourly_budget = get_hourly_budget()
+    worker_id = get_worker_id()
+    batch_size = int(os.getenv('CRAWL_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    products_crawled = 0
     
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, marketplace_key, url FROM products")
-    now = datetime.datetime.now()
-    etl_date = now.strftime("%Y-%m-%d %H:%M:%S")
-    while True:
-        rows = cursor.fetchmany(1000)
-        objects_to_parse = []
-        if not rows:
-            break
-        for guid, key, url in rows:
-            obj = ParsingObject(guid, key, url, etl_date)
-            objects_to_parse.append(obj)
-        df = parse_and_transform_data(objects_to_parse)
-        if df is None:
-            print("Parsing job wasn't finished as data was not parsed")
-        insert_data_to_db(df)
-        print("Parsing job is finished")
+    try:
+        with pooled_connection() as run_conn:
+            with run_conn.cursor() as run_cursor:
+                maintain_partitions(run_cursor)
+                ensure_crawl_state(run_cursor)
+                crawl_run = start_or_resume_run(run_cursor, worker_id)
+        if crawl_run.resumed:
+            logger.info("Resuming crawl run %s after product %s", crawl_run.id, crawl_run.last_product_id)
+        etl_date = crawl_run.etl_date.strftime("%Y-%m-%d %H:%M:%S")
+
+        while True:
+            now = datetime.datetime.now()
+            with pooled_connection() as run_conn:
+                with run_conn.cursor() as run_cursor:
+                    limit = batch_size
+                    remaining_budget = get_remaining_budget(run_cursor, hourly_budget, now)
+                    if remaining_budget is not None:
+                        limit = min(limit, remaining_budget)
+                    states = claim_due_products(run_cursor, limit, now, worker_id) if limit > 0 else []
+            if not states:
+                if limit <= 0:
+                    logger.info("Hourly crawl budget is used up, remaining products wait for the next run")
+                break
+            products_crawled += len(states)
+            objects_to_parse = [
+                ParsingObject(state.product_id, state.marketplace_key, state.url, etl_date)
+                for state in states
+            ]
+            df = parse_and_transform_data(objects_to_parse, fetcher)
+            prices = dict()
+            if df is not None:
+                prices = dict(zip(df['product_id'], df['price_proceeded']))
+            # Rows, schedule and checkpoint commit together, crawled products are no longer due after a restart
+            with pooled_connection() as run_conn:
+                with run_conn.cursor() as run_cursor:
+                    if df is not None:
+                        write_price_observations(run_cursor, df.itertuples(index=False, name=None))
+                    update_crawl_state(run_cursor, states, prices, policy, now, worker_id)
+                    checkpoint_run(run_cursor, crawl_run.id, states[-1].product_id, len(prices), len(states) - len(prices))
+            if df is None:
+                logger.warning("Batch of %s products was not parsed", len(states))
+                continue
+            logger.info("Parsed %s of %s products", len(prices), len(states))
+
+        with pooled_connection() as run_conn:
+            with run_conn.cursor() as run_cursor:
+                finish_run(run_cursor, crawl_run.id)
+        return products_crawled
+    finally:
+        if extraction_pool is not None:
+            extraction_pool.shutdown()
+        if page_cache is not None:
+            page_cache.close()
+        parser.close()
 
 def job():
     try:
         main()
     except Exception as e:
-        print(f"[{datetime.datetime.now()}] Error: {e}")
-
-schedule.every().day.at("03:00").do(job)
+        logger.error("Crawl failed: %s", e)
 
 if __name__ == "__main__":
+    configure_logging()
     job()
+    # Only due products are crawled, so the job runs often and mostly finds little to do
+    schedule.every(int(os.getenv('RECRAWL_TICK_MINUTES', DEFAULT_TICK_MINUTES))).minutes.do(job)
     while True:
         schedule.run_pending()
         time.sleep(50)
\ No newline at end of file
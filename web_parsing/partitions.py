@@ -0,0 +1,103 @@
+import logging
+import os
+import re
+from datetime import date, datetime
+from .db import pooled_connection
+from .tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITIONS_AHEAD = 2
+# 0 keeps every partition
+DEFAULT_RETENTION_MONTHS = 0
+RETENTION_MODES = ('archive', 'drop')
+DEFAULT_RETENTION_MODE = 'archive'
+ARCHIVE_SCHEMA = 'parsed_products_archive'
+PARTITION_NAME_PATTERN = re.compile(r'^parsed_products_(\d{4})_(\d{2})$')
+# Any constant works, it only has to be the same for every process maintaining partitions
+PARTITIONS_LOCK_ID = 7420136
+
+def add_months(month, months):
+    """First day of the month ``months`` after the month of ``month``"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def get_retention_months():
+    return int(os.getenv('PARSED_PRODUCTS_RETENTION_MONTHS', DEFAULT_RETENTION_MONTHS))
+
+def get_retention_mode():
+    mode = os.getenv('PARSED_PRODUCTS_RETENTION_MODE', DEFAULT_RETENTION_MODE)
+    if mode not in RETENTION_MODES:
+        raise Exception(f"Unknown retention mode '{mode}', expected one of: {', '.join(RETENTION_MODES)}.")
+    return mode
+
+def ensure_partitions(cursor, now, months_ahead=None):
+    """Create the partitions of the current month and ``months_ahead`` months after it"""
+    if months_ahead is None:
+        months_ahead = int(os.getenv('PARSED_PRODUCTS_PARTITIONS_AHEAD', DEFAULT_PARTITIONS_AHEAD))
+    for months in range(months_ahead + 1):
+        cursor.execute("SELECT create_parsed_products_partition(%s)", (add_months(now, months),))
+
+def get_monthly_partitions(cursor):
+    """(name, first day of the month) of every attached monthly partition, oldest first"""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'parsed_products'::regclass
+    """)
+    partitions = list()
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_PATTERN.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def apply_retention(cursor, now, retention_months=None, mode=None):
+    """Detach the partitions of months older than ``retention_months``, returns their names.
+
+    With change-only storage an old row may still be the current price of
+    a product, so a partition is only detached once none of its rows was
+    seen after the cutoff. Detached partitions move to the archive schema
+    or are dropped, depending on ``mode``.
+    """
+    if retention_months is None:
+        retention_months = get_retention_months()
+    if retention_months <= 0:
+        return []
+    if mode is None:
+        mode = get_retention_mode()
+    cutoff = add_months(now, -retention_months)
+    detached = list()
+    for name, month in get_monthly_partitions(cursor):
+        if add_months(month, 1) > cutoff:
+            break
+        cursor.execute(f'SELECT max(last_seen_at) FROM "{name}"')
+        last_seen_at = cursor.fetchone()[0]
+        if last_seen_at is not None and last_seen_at.date() >= cutoff:
+            logger.info("Keeping partition %s, its prices were seen until %s", name, last_seen_at)
+            continue
+        cursor.execute(f'ALTER TABLE parsed_products DETACH PARTITION "{name}"')
+        if mode == 'drop':
+            cursor.execute(f'DROP TABLE "{name}"')
+        else:
+            cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+            cursor.execute(f'ALTER TABLE "{name}" SET SCHEMA {ARCHIVE_SCHEMA}')
+        logger.info("Detached partition %s (%s)", name, mode)
+        detached.append(name)
+    return detached
+
+def maintain_partitions(cursor, now=None):
+    """Create upcoming partitions and apply retention, safe to run from several workers at once"""
+    if now is None:
+        now = datetime.now()
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITIONS_LOCK_ID,))
+    ensure_partitions(cursor, now)
+    return apply_retention(cursor, now)
+
+if __name__ == '__main__':
+    configure_logging()
+    with pooled_connection() as connection:
+        with connection.cursor() as cursor:
+            detached = maintain_partitions(cursor)
+    print(f"Detached partitions: {', '.join(detached)}" if detached else "No partitions detached")
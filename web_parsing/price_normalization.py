@@ -0,0 +1,123 @@
+import re
+import numpy as np
+import pandas as pd
+
+NON_NUMERIC_PATTERN = re.compile(r'[^\d.,]')
+THOUSANDS_PATTERN = re.compile(r'(?<=\d)[\s,](?=\d{3}\b)')
+CURRENCY_SYMBOL_PATTERN = re.compile(r'[\$\€\£\¥\₹\₽\₩\₪\฿\₫\₦\₴]')
+CURRENCY_CODE_PATTERN = re.compile(
+    r'\b(?:USD|EUR|GBP|JPY|AUD|CAD|CHF|CNY|RUB|KRW|INR|UAH|PLN|NZD)\b',
+    flags=re.IGNORECASE
+)
+
+class PriceLocale:
+    """How a marketplace writes prices.
+
+    Without a ``decimal_separator`` the separators are guessed per value:
+    several commas are thousands separators, a single comma without a dot
+    is the decimal separator. With one, everything but digits and the
+    decimal separator is dropped. ``currency`` is used when the text names
+    no currency.
+    """
+
+    def __init__(self, decimal_separator=None, currency=None):
+        self.decimal_separator = decimal_separator
+        self.currency = currency
+        self.__cleanup_pattern = None
+        if decimal_separator is not None:
+            if len(decimal_separator) != 1 or decimal_separator.isdigit():
+                raise Exception(f"Invalid decimal separator '{decimal_separator}'. Check configuration file.")
+            self.__cleanup_pattern = re.compile(f'[^\\d{re.escape(decimal_separator)}]')
+
+    @classmethod
+    def from_config(cls, locale_config):
+        """Locale from the optional ``price_locale`` object of a marketplace configuration"""
+        if not locale_config:
+            return AUTO_LOCALE
+        return cls(
+            decimal_separator=locale_config.get('decimal_separator'),
+            currency=locale_config.get('currency')
+        )
+
+    def clean_number(self, text):
+        """Number part of ``text`` with '.' as the decimal point and no thousands separators"""
+        text = text.replace('\u00A0', '').strip()
+        if self.__cleanup_pattern is not None:
+            return self.__cleanup_pattern.sub('', text).replace(self.decimal_separator, '.')
+        number_text = NON_NUMERIC_PATTERN.sub('', text)
+        comma_count = number_text.count(',')
+        if comma_count > 1:
+            return number_text.replace(',', '')
+        if comma_count == 1 and '.' not in number_text:
+            return number_text.replace(',', '.')
+        return THOUSANDS_PATTERN.sub('', number_text)
+
+AUTO_LOCALE = PriceLocale()
+# schema.org and OpenGraph prices always use '.' as the decimal point
+STRUCTURED_DATA_LOCALE = PriceLocale(decimal_separator='.')
+
+def normalize_price(raw, locale=AUTO_LOCALE):
+    """Price as a float, None when ``raw`` holds no number"""
+    if raw is None:
+        return None
+    if isinstance(raw, (int, float, np.number)):
+        return None if raw != raw else float(raw)
+    try:
+        return float(locale.clean_number(str(raw)))
+    except ValueError:
+        return None
+
+def normalize_currency(raw, locale=AUTO_LOCALE):
+    """Currency symbol or upper-cased ISO code named in ``raw``, otherwise the locale currency"""
+    if raw is None:
+        return locale.currency
+    text = str(raw)
+    match = CURRENCY_SYMBOL_PATTERN.search(text)
+    if match:
+        return match.group()
+    match = CURRENCY_CODE_PATTERN.search(text)
+    if match:
+        return match.group().upper()
+    return locale.currency
+
+def split_by_locale(locales):
+    """(locale, positions) of every distinct PriceLocale in ``locales``"""
+    codes, uniques = pd.factorize(pd.Series(locales, dtype=object).to_numpy())
+    return [(unique, np.flatnonzero(codes == code)) for code, unique in enumerate(uniques)]
+
+def normalize_prices(values, locale=AUTO_LOCALE):
+    """``normalize_price`` for a whole batch, returns a float Series (NaN for missing prices).
+
+    Every distinct raw text is parsed once, crawled prices repeat a lot.
+    ``locale`` is one PriceLocale for every value or one per value, values
+    sharing a locale are parsed together.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values, dtype=object)
+    if not isinstance(locale, PriceLocale):
+        prices = np.full(len(values), np.nan)
+        for row_locale, positions in split_by_locale(locale):
+            prices[positions] = normalize_prices(values.iloc[positions], row_locale).to_numpy()
+        return pd.Series(prices, index=values.index)
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_numeric(values, errors='coerce').astype(float)
+    codes, uniques = pd.factorize(values)
+    # Missing values get code -1, the NaN appended last
+    parsed = np.array([normalize_price(raw, locale) for raw in uniques] + [np.nan], dtype=float)
+    return pd.Series(parsed[codes], index=values.index)
+
+def normalize_currencies(values, locale=AUTO_LOCALE):
+    """``normalize_currency`` for a whole batch, every distinct raw text is matched once.
+
+    ``locale`` is one PriceLocale or one per value, like for ``normalize_prices``.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values, dtype=object)
+    if not isinstance(locale, PriceLocale):
+        currencies = np.empty(len(values), dtype=object)
+        for row_locale, positions in split_by_locale(locale):
+            currencies[positions] = normalize_currencies(values.iloc[positions], row_locale).to_numpy()
+        return pd.Series(currencies, index=values.index, dtype=object)
+    codes, uniques = pd.factorize(values)
+    matched = np.array([normalize_currency(raw, locale) for raw in uniques] + [locale.currency], dtype=object)
+    return pd.Series(matched[codes], index=values.index, dtype=object)
@@ -1,74 +1,115 @@
-import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import psycopg2
-from sqlalchemy import create_engine
 from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 from sklearn.model_selection import TimeSeriesSplit
 import math
+import logging
+import os
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from .batch_prediction import RESAMPLE_INTERVAL
+from .bulk_writer import bulk_insert
+from .db import pooled_connection
+from .model_store import HISTORY_FETCH_SIZE, read_price_histories, train_models
+from .tracing import configure_logging
 
-# ------------------------------------------------------
-# 1. Database Connection (psycopg2 for cursor batching)
-# ------------------------------------------------------
-def get_db_connection():
-    return psycopg2.connect(
-        dbname   = os.getenv("DB_NAME",     "parse_db"),
-        user     = os.getenv("DB_USER",     "parser"),
-        password = os.getenv("DB_PASSWORD", "123456"),
-        host     = os.getenv("DB_HOST",     "localhost"),
-        port     = os.getenv("DB_PORT",     "5432")
-    )
+logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------
-# 2. SQLAlchemy engine for bulk inserts & reads
+# 1-2. Database access goes through the shared pools of web_parsing.db
 # ------------------------------------------------------
-def get_sqlalchemy_engine():
-    user = os.getenv("DB_USER", "parser")
-    pw   = os.getenv("DB_PASSWORD", "123456")
-    host = os.getenv("DB_HOST", "localhost")
-    port = os.getenv("DB_PORT", "5432")
-    db   = os.getenv("DB_NAME", "parse_db")
-    url  = f"postgresql+psycopg2://{user}:{pw}@{host}:{port}/{db}"
-    return create_engine(url)
 
 # ------------------------------------------------------
-# 3. Fetch product IDs in batches
+# 3. Fetch the products to predict in batches
 # ------------------------------------------------------
-def fetch_product_id_batches(batch_size=1000):
-    conn = get_db_connection()
-    cur  = conn.cursor(name="prod_id_cursor")
-    cur.itersize = batch_size
-    try:
-        cur.execute("SELECT id FROM products")
-        while True:
-            rows = cur.fetchmany(batch_size)
-            if not rows:
-                break
-            yield [r[0] for r in rows]
-    finally:
-        cur.close()
-        conn.close()
+def fetch_fingerprint_batches(batch_size=1000, changed_only=True):
+    """Yields {product_id: (last_seen_at, price, changed)} batches in product_id order.
+
+    The fingerprint is the latest parsed_products row of a product (its
+    last_seen_at and price), which changes with every new observation.
+    Each product reads a single entry of the covering (product_id,
+    etl_date) index. ``changed`` tells whether it differs from the
+    fingerprint stored with the latest prediction of the product. With
+    ``changed_only`` the unchanged products are left out, nothing new was
+    seen since.
+    """
+    query = """
+        SELECT
+            p.id, latest.last_seen_at, latest.price_proceeded,
+            (latest.last_seen_at, latest.price_proceeded)
+                IS DISTINCT FROM (predicted.history_last_seen_at, predicted.history_last_price) AS changed
+        FROM products p
+        CROSS JOIN LATERAL (
+            SELECT last_seen_at, price_proceeded
+            FROM parsed_products
+            WHERE product_id = p.id
+            ORDER BY etl_date DESC
+            LIMIT 1
+        ) latest
+        LEFT JOIN LATERAL (
+            SELECT history_last_seen_at, history_last_price
+            FROM product_price_predictions
+            WHERE product_id = p.id
+            ORDER BY etl_date DESC
+            LIMIT 1
+        ) predicted ON true
+    """
+    if changed_only:
+        query += """
+            WHERE (latest.last_seen_at, latest.price_proceeded)
+                IS DISTINCT FROM (predicted.history_last_seen_at, predicted.history_last_price)
+        """
+    # A stable order keeps shards, and so the prediction output, the same from run to run
+    query += " ORDER BY p.id"
+    with pooled_connection() as conn:
+        with conn.cursor(name="fingerprint_cursor") as cur:
+            cur.itersize = batch_size
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield {row[0]: row[1:] for row in rows}
 
 # ------------------------------------------------------
-# 4. Fetch price history for one product
+# 4. Fetch price histories, one query per batch of products
 # ------------------------------------------------------
+def load_price_histories(product_ids, fetch_size=HISTORY_FETCH_SIZE):
+    """Price histories of ``product_ids`` read with a single query, products without observations are left out"""
+    with pooled_connection() as conn:
+        return read_price_histories(conn, """
+            SELECT product_id, (extract(epoch FROM etl_date) * 1000000)::int8, price_proceeded::float8
+            FROM price_observations
+            WHERE product_id = ANY(%s)
+            ORDER BY product_id, etl_date
+        """, (list(product_ids),), fetch_size)
+
+def fetch_price_histories(product_ids, fetch_size=HISTORY_FETCH_SIZE):
+    """Yields (product_id, DataFrame) of ``load_price_histories`` in product_id order"""
+    histories = load_price_histories(product_ids, fetch_size)
+    for product_id, start, end in zip(histories.product_ids, histories.starts, histories.ends):
+        yield int(product_id), pd.DataFrame({'etl_date': histories.dates[start:end], 'price': histories.prices[start:end]}, copy=False)
+
 def fetch_price_history(product_id):
-    sql = """
-        SELECT etl_date, price_proceeded AS price
-        FROM parsed_products
-        WHERE product_id = %s
-        ORDER BY etl_date
-    """
-    engine = get_sqlalchemy_engine()
-    df     = pd.read_sql(sql, con=engine, params=(product_id,))
-    df['etl_date'] = pd.to_datetime(df['etl_date'])
-    return df
+    for _, df in fetch_price_histories([product_id]):
+        return df
+    return pd.DataFrame({'etl_date': np.array([], dtype='datetime64[ns]'), 'price': np.array([], dtype=float)})
 
 # ------------------------------------------------------
-# 5. Preprocess & remove outliers
+# 5. Resample, preprocess & remove outliers
 # ------------------------------------------------------
+def resample_prices(df):
+    """Prices in effect every RESAMPLE_INTERVAL from the first to the last observation, a price holds until the next one"""
+    interval = pd.Timedelta(RESAMPLE_INTERVAL)
+    if df.empty:
+        return df
+    grid = pd.date_range(df['etl_date'].min().ceil(interval), df['etl_date'].max().floor(interval), freq=interval)
+    prices = df.set_index('etl_date')['price'].reindex(grid, method='ffill')
+    return pd.DataFrame({'etl_date': grid, 'price': prices.to_numpy()})
+
 def preprocess(df):
     df = df.dropna(subset=['price']).copy()
     mu, sigma = df['price'].mean(), df['price'].std()
@@ -133,42 +174,112 @@ def predict_and_index(model, df, days_ahead=1):
 # ------------------------------------------------------
 # 9. Bulk insert predictions
 # ------------------------------------------------------
+PREDICTION_COLUMNS = [
+    'product_id', 'predicted_price', 'change_index', 'etl_date',
+    'history_last_seen_at', 'history_last_price'
+]
+
 def insert_predictions_batch(records):
-    engine = get_sqlalchemy_engine()
-    df = pd.DataFrame(records)
-    df.to_sql(
+    bulk_insert(
         'product_price_predictions',
-        con=engine,
-        if_exists='append',
-        index=False,
-        method='multi'
+        PREDICTION_COLUMNS,
+        ([record[column] for column in PREDICTION_COLUMNS] for record in records)
     )
 
 # ------------------------------------------------------
-# 10. Orchestration: batch over all products
-# ------------------------------------------------------
-def batch_main(days_ahead=30):
-    for batch in fetch_product_id_batches(batch_size=1000):
-        preds = []
-        now   = datetime.now()
-        for pid in batch:
-            hist = fetch_price_history(pid)
-            if len(hist) < 5:
-                continue
-            clean = preprocess(hist)
-            X, y, feat = engineer_features(clean)
-            _, model = train_and_evaluate(X, y)
-            price, fut_dt, ch_idx = predict_and_index(model, clean, days_ahead)
-            preds.append({
-                'product_id':      pid,
-                'predicted_price': price,
-                'change_index':    ch_idx,
-                'etl_date':        now
-            })
-        if preds:
-            insert_predictions_batch(preds)
-            print(f"Inserted {len(preds)} predictions for this batch at {now.isoformat()}")
-    print("All batches processed.")
+# 10. Incremental model states and stored models, see model_store
+# ------------------------------------------------------
+PREDICTION_MODES = ('incremental', 'full')
+DEFAULT_PREDICTION_MODE = 'incremental'
+# Incremental states filter outliers slice by slice and keep the rows of
+# detached partitions, the scheduler rebuilds them from the history daily
+DEFAULT_FULL_REBUILD_TIME = '03:00'
+
+def get_prediction_mode():
+    mode = os.getenv('PREDICTION_MODE', DEFAULT_PREDICTION_MODE)
+    if mode not in PREDICTION_MODES:
+        raise Exception(f"Unknown prediction mode '{mode}', expected one of: {', '.join(PREDICTION_MODES)}.")
+    return mode
+
+# ------------------------------------------------------
+# 11. Orchestration: shard batches over worker processes
+# ------------------------------------------------------
+DEFAULT_PREDICTION_BATCH_SIZE = 1000
+
+def get_prediction_workers():
+    return int(os.getenv('PREDICTION_WORKERS', os.cpu_count() or 1))
+
+def predict_shard(product_ids, days_ahead, now, mode):
+    """Steps 4-8 for one batch of products, returns (products, product ids, prices, change indexes).
+
+    Only the observations since the previous run are read and folded into
+    the model states, the ``full`` mode rebuilds them from the whole
+    history. The refitted models are stored in product_models. Runs in a
+    worker process, which uses its own pool, see db.reset_after_fork.
+    """
+    models = train_models(product_ids, now, rebuild=mode == 'full')
+    prices, ch_idxs = models.predict(days_ahead)
+    return len(product_ids), models.product_ids, prices, ch_idxs
+
+def iter_shard_results(shards, days_ahead, now, mode, workers):
+    """(shard, predict_shard result) in the order of ``shards``, whatever the number of workers.
+
+    A shard is any collection of product ids. At most two shards per worker
+    are in flight, so the product cursor is not read far ahead of the
+    writer.
+    """
+    if workers <= 1:
+        for shard in shards:
+            yield shard, predict_shard(list(shard), days_ahead, now, mode)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append((shard, executor.submit(predict_shard, list(shard), days_ahead, now, mode)))
+            if len(pending) >= 2 * workers:
+                shard, future = pending.popleft()
+                yield shard, future.result()
+        while pending:
+            shard, future = pending.popleft()
+            yield shard, future.result()
+
+def batch_main(days_ahead=30, workers=None, batch_size=DEFAULT_PREDICTION_BATCH_SIZE, mode=None):
+    """Predict the products whose history changed since their last prediction.
+
+    The ``full`` mode rebuilds the states and models of every product, but
+    still only inserts predictions of the changed ones. This process is
+    the only writer of product_price_predictions, every prediction is
+    stored with the history fingerprint it was made from.
+    """
+    if workers is None:
+        workers = get_prediction_workers()
+    if mode is None:
+        mode = get_prediction_mode()
+    # One etl_date for the whole run, the rows don't depend on when a shard finished
+    now = datetime.now()
+    total = 0
+    # Closed right away on errors, the cursor's transaction must not outlive the run
+    with closing(fetch_fingerprint_batches(batch_size=batch_size, changed_only=mode != 'full')) as shards:
+        results = iter_shard_results(shards, days_ahead, now, mode, workers)
+        for shard_index, (fingerprints, (products, pids, prices, ch_idxs)) in enumerate(results, 1):
+            preds = [
+                {
+                    'product_id':           int(pid),
+                    'predicted_price':      float(price),
+                    'change_index':         float(ch_idx),
+                    'etl_date':             now,
+                    'history_last_seen_at': fingerprints[pid][0],
+                    'history_last_price':   fingerprints[pid][1]
+                }
+                for pid, price, ch_idx in zip(pids.tolist(), prices, ch_idxs)
+                if fingerprints[pid][2]
+            ]
+            if preds:
+                insert_predictions_batch(preds)
+            total += len(preds)
+            logger.info("Shard %s: inserted %s predictions for %s products", shard_index, len(preds), products)
+    logger.info("All batches processed, %s predictions at %s with %s workers (%s)", total, now.isoformat(), workers, mode)
 
 if __name__ == '__main__':
-    batch_main(days_ahead=30)
\ No newline at end of file
+    configure_logging()
+    batch_main(days_ahead=30)
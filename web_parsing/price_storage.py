@@ -0,0 +1,82 @@
+import os
+from .bulk_writer import copy_rows, upsert_rows
+
+STORAGE_MODES = ('change_only', 'append')
+DEFAULT_STORAGE_MODE = 'change_only'
+
+def get_storage_mode():
+    mode = os.getenv('PRICE_STORAGE_MODE', DEFAULT_STORAGE_MODE)
+    if mode not in STORAGE_MODES:
+        raise Exception(f"Unknown price storage mode '{mode}', expected one of: {', '.join(STORAGE_MODES)}.")
+    return mode
+
+def has_price(row):
+    """False for observations without a price (None or NaN), failed parses are not price changes"""
+    price = row[1]
+    return price is not None and price == price
+
+def write_price_observations(cursor, rows, mode=None):
+    """Store (product_id, price_proceeded, etl_date) observations in parsed_products.
+
+    In ``append`` mode every observation becomes a row. In ``change_only``
+    mode an observation of the price the product already has only moves
+    ``last_seen_at`` of its latest row, a new row is written when the price
+    changes. Observations without a price are skipped in both modes, they
+    would otherwise split the current price range. Writing the same
+    observations again changes nothing.
+    """
+    if mode is None:
+        mode = get_storage_mode()
+    rows = filter(has_price, rows)
+    if mode == 'append':
+        upsert_rows(
+            cursor, 'parsed_products', ['product_id', 'price_proceeded', 'etl_date', 'last_seen_at'],
+            ((product_id, price, etl_date, etl_date) for product_id, price, etl_date in rows),
+            conflict_columns=['product_id', 'etl_date']
+        )
+        return
+
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS price_observations_staging (
+            product_id INTEGER,
+            price_proceeded NUMERIC,
+            etl_date TIMESTAMP
+        ) ON COMMIT DROP
+    """)
+    copy_rows(cursor, 'price_observations_staging', ['product_id', 'price_proceeded', 'etl_date'], rows)
+    cursor.execute("""
+        WITH latest AS (
+            SELECT s.product_id, s.price_proceeded, s.etl_date, l.id AS latest_id, l.etl_date AS latest_etl_date
+            FROM price_observations_staging s
+            CROSS JOIN LATERAL (
+                SELECT p.id, p.price_proceeded, p.etl_date
+                FROM parsed_products p
+                WHERE p.product_id = s.product_id
+                ORDER BY p.etl_date DESC
+                LIMIT 1
+            ) l
+            WHERE l.price_proceeded IS NOT DISTINCT FROM s.price_proceeded
+              AND l.etl_date <= s.etl_date
+        ),
+        extended AS (
+            UPDATE parsed_products p
+            SET last_seen_at = GREATEST(p.last_seen_at, latest.etl_date)
+            FROM latest
+            WHERE p.id = latest.latest_id AND p.etl_date = latest.latest_etl_date
+            RETURNING p.product_id
+        )
+        INSERT INTO parsed_products (product_id, price_proceeded, etl_date, last_seen_at)
+        SELECT s.product_id, s.price_proceeded, s.etl_date, s.etl_date
+        FROM price_observations_staging s
+        WHERE s.product_id NOT IN (SELECT product_id FROM extended)
+          AND NOT EXISTS (
+              SELECT 1
+              FROM parsed_products p
+              WHERE p.product_id = s.product_id
+                AND p.etl_date <= s.etl_date
+                AND p.last_seen_at >= s.etl_date
+                AND p.price_proceeded IS NOT DISTINCT FROM s.price_proceeded
+          )
+        ON CONFLICT (product_id, etl_date) DO UPDATE SET price_proceeded = EXCLUDED.price_proceeded
+    """)
+    cursor.execute("TRUNCATE price_observations_staging")
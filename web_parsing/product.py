@@ -5,6 +5,8 @@ class Product:
         self._name = None
         self._price = None
         self._currency = None
+        # Price and currency hold the text found on the page, normalized later in the locale of its source
+        self._structured_price = False
         self._etl_date = None
 
     def __str__(self):
@@ -40,6 +42,12 @@ class Product:
     def set_currency(self, currency):
         self._currency = currency
 
+    def get_structured_price(self):
+        return self._structured_price
+
+    def set_structured_price(self, structured_price):
+        self._structured_price = structured_price
+
     def set_etl_date(self, date_time):
         self._etl_date = date_time
     
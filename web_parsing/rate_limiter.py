@@ -0,0 +1,147 @@
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+DEFAULT_RATE = 5.0
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RATE = 50.0
+DEFAULT_BURST = 5
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_CAP = 60.0
+DEFAULT_DECREASE_COOLDOWN = 2.0
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header, None if it is missing or malformed"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+class TokenBucket:
+    """Asyncio token bucket refilled at ``rate`` tokens per second up to ``burst`` tokens"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__updated_at = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__lock = None
+        self.__lock_loop = None
+
+    def __get_lock(self):
+        # Buckets outlive the event loop of a single crawl batch, the lock must not
+        loop = asyncio.get_running_loop()
+        if self.__lock is None or self.__lock_loop is not loop:
+            self.__lock = asyncio.Lock()
+            self.__lock_loop = loop
+        return self.__lock
+
+    def __refill(self, now):
+        if now <= self.__updated_at:
+            return
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+    async def acquire(self):
+        # The lock makes waiters take tokens in arrival order
+        async with self.__get_lock():
+            while True:
+                now = time.monotonic()
+                if now < self.__blocked_until:
+                    await asyncio.sleep(self.__blocked_until - now)
+                    continue
+                self.__refill(now)
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.__tokens) / self.rate)
+
+    def block_for(self, seconds):
+        """Stop handing out tokens for ``seconds``, used when the server asks us to back off"""
+        self.__blocked_until = max(self.__blocked_until, time.monotonic() + seconds)
+        self.__tokens = 0.0
+        self.__updated_at = max(self.__updated_at, self.__blocked_until)
+
+    def set_rate(self, rate):
+        self.__refill(time.monotonic())
+        self.rate = rate
+
+class AdaptiveRateLimiter:
+    """Token bucket per marketplace key whose rate follows the observed error rate.
+
+    Every success raises the marketplace rate a little (additive increase),
+    a 429/503 cuts it in half (multiplicative decrease), within ``min_rate``
+    and ``max_rate`` requests per second. Requests already in flight usually
+    get throttled together, so throttling within ``decrease_cooldown``
+    seconds of the last cut counts as the same event.
+    """
+
+    def __init__(self, rate=None, min_rate=None, max_rate=None, burst=None, marketplace_rates=None, decrease_cooldown=None):
+        self.rate = rate or float(os.getenv('CRAWL_RATE', DEFAULT_RATE))
+        self.min_rate = min_rate or float(os.getenv('CRAWL_MIN_RATE', DEFAULT_MIN_RATE))
+        self.max_rate = max_rate or float(os.getenv('CRAWL_MAX_RATE', DEFAULT_MAX_RATE))
+        self.burst = burst or int(os.getenv('CRAWL_BURST', DEFAULT_BURST))
+        self.marketplace_rates = marketplace_rates or dict()
+        self.decrease_cooldown = decrease_cooldown or float(os.getenv('CRAWL_DECREASE_COOLDOWN', DEFAULT_DECREASE_COOLDOWN))
+        self.__buckets = dict()
+        self.__decreased_at = dict()
+
+    def get_bucket(self, marketplace_key):
+        bucket = self.__buckets.get(marketplace_key)
+        if bucket is None:
+            rate = self.marketplace_rates.get(marketplace_key, self.rate)
+            bucket = TokenBucket(rate, self.burst)
+            self.__buckets[marketplace_key] = bucket
+        return bucket
+
+    async def acquire(self, marketplace_key):
+        await self.get_bucket(marketplace_key).acquire()
+
+    def record_success(self, marketplace_key):
+        bucket = self.get_bucket(marketplace_key)
+        # Roughly +1 request/second after every `rate` successes
+        bucket.set_rate(min(self.max_rate, bucket.rate + 1.0 / max(bucket.rate, 1.0)))
+
+    def record_throttled(self, marketplace_key, retry_after=None):
+        bucket = self.get_bucket(marketplace_key)
+        now = time.monotonic()
+        if now - self.__decreased_at.get(marketplace_key, float('-inf')) >= self.decrease_cooldown:
+            bucket.set_rate(max(self.min_rate, bucket.rate / 2))
+            self.__decreased_at[marketplace_key] = now
+        if retry_after:
+            bucket.block_for(retry_after)
+
+    def get_rate(self, marketplace_key):
+        return self.get_bucket(marketplace_key).rate
+
+class RetryPolicy:
+    """Jittered exponential backoff for retryable responses"""
+
+    def __init__(self, max_retries=None, backoff_base=None, backoff_cap=None):
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('CRAWL_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+        self.backoff_base = backoff_base or float(os.getenv('CRAWL_BACKOFF_BASE', DEFAULT_BACKOFF_BASE))
+        self.backoff_cap = backoff_cap or float(os.getenv('CRAWL_BACKOFF_CAP', DEFAULT_BACKOFF_CAP))
+
+    def is_retryable(self, status):
+        return status in RETRYABLE_STATUSES
+
+    def get_delay(self, attempt, retry_after=None):
+        """Full jitter backoff for ``attempt`` (0-based), never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
@@ -0,0 +1,145 @@
+import logging
+import math
+import os
+from datetime import timedelta
+from psycopg2 import sql
+from .bulk_writer import upsert_rows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL_HOURS = 2
+DEFAULT_MAX_INTERVAL_HOURS = 72
+DEFAULT_FAILURE_BACKOFF_HOURS = 1
+DEFAULT_HOURLY_BUDGET = 0
+DEFAULT_LEASE_SECONDS = 1800
+# Weight of the latest crawl in the exponentially weighted change rate
+CHANGE_RATE_WEIGHT = 0.3
+PRICE_TOLERANCE = 1e-6
+
+STATE_COLUMNS = ['product_id', 'next_due_at', 'last_crawled_at', 'last_price', 'change_rate', 'failure_count', 'lease_owner', 'lease_expires_at']
+
+class ProductState:
+    def __init__(self, product_id, marketplace_key, url, last_price, change_rate, failure_count, subscribers):
+        self.product_id = product_id
+        self.marketplace_key = marketplace_key
+        self.url = url
+        self.last_price = last_price
+        self.change_rate = change_rate
+        self.failure_count = failure_count
+        self.subscribers = subscribers
+
+class RecrawlPolicy:
+    """Decides when a product is crawled next.
+
+    The interval goes from ``max_interval_hours`` for prices that never
+    change down to ``min_interval_hours`` for prices that change on every
+    crawl, and shrinks further with the number of subscribers. Failed crawls
+    are retried after ``failure_backoff_hours`` doubled for every consecutive
+    failure, up to the maximum interval.
+    """
+
+    def __init__(self, min_interval_hours=None, max_interval_hours=None, failure_backoff_hours=None):
+        self.min_interval_hours = min_interval_hours or float(os.getenv('RECRAWL_MIN_INTERVAL_HOURS', DEFAULT_MIN_INTERVAL_HOURS))
+        self.max_interval_hours = max_interval_hours or float(os.getenv('RECRAWL_MAX_INTERVAL_HOURS', DEFAULT_MAX_INTERVAL_HOURS))
+        self.failure_backoff_hours = failure_backoff_hours or float(os.getenv('RECRAWL_FAILURE_BACKOFF_HOURS', DEFAULT_FAILURE_BACKOFF_HOURS))
+
+    def get_interval(self, change_rate, subscribers):
+        """Hours until the next crawl of a product that was crawled successfully"""
+        interval = self.max_interval_hours - (self.max_interval_hours - self.min_interval_hours) * change_rate
+        interval /= 1 + math.log2(1 + subscribers)
+        return max(self.min_interval_hours, interval)
+
+    def get_failure_delay(self, failure_count):
+        """Hours until the next attempt after ``failure_count`` consecutive failures"""
+        return min(self.max_interval_hours, self.failure_backoff_hours * 2 ** min(failure_count - 1, 32))
+
+def get_hourly_budget():
+    return int(os.getenv('CRAWL_HOURLY_BUDGET', DEFAULT_HOURLY_BUDGET))
+
+def get_lease_duration():
+    return timedelta(seconds=int(os.getenv('CRAWL_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)))
+
+def ensure_crawl_state(cursor):
+    """Add products created since the last run, they are due right away"""
+    cursor.execute("""
+        INSERT INTO product_crawl_state (product_id)
+        SELECT id FROM products
+        ON CONFLICT (product_id) DO NOTHING
+    """)
+
+def get_remaining_budget(cursor, hourly_budget, now):
+    """Crawls still allowed in the current hour, None when there is no budget.
+
+    Products leased by any worker count as crawled, so workers running in
+    parallel share the budget.
+    """
+    if not hourly_budget:
+        return None
+    cursor.execute(
+        "SELECT count(*) FROM product_crawl_state WHERE last_crawled_at > %s OR lease_expires_at > %s",
+        (now - timedelta(hours=1), now)
+    )
+    return max(0, hourly_budget - cursor.fetchone()[0])
+
+def claim_due_products(cursor, limit, now, worker_id, lease_duration=None):
+    """Lease up to ``limit`` due products to ``worker_id``, the most overdue first.
+
+    Rows being claimed by another worker are skipped instead of waited for,
+    and a claimed product is not offered again until ``update_crawl_state``
+    releases it or the lease expires, so a crashed worker's products return
+    to the queue on their own. Commit right after claiming, the lease is what
+    keeps other workers away during the crawl.
+    """
+    if lease_duration is None:
+        lease_duration = get_lease_duration()
+    cursor.execute("""
+        WITH due AS (
+            SELECT product_id
+            FROM product_crawl_state
+            WHERE next_due_at <= %s
+              AND (lease_expires_at IS NULL OR lease_expires_at <= %s)
+            ORDER BY next_due_at, product_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE product_crawl_state s
+        SET lease_owner = %s, lease_expires_at = %s
+        FROM due
+        JOIN products p ON p.id = due.product_id
+        WHERE s.product_id = due.product_id
+        RETURNING
+            s.product_id, p.marketplace_key, p.url,
+            s.last_price, s.change_rate, s.failure_count,
+            (SELECT count(*) FROM users_products_subscriptions u WHERE u.product_id = s.product_id),
+            s.next_due_at
+    """, (now, now, limit, worker_id, now + lease_duration))
+    rows = sorted(cursor.fetchall(), key=lambda row: (row[-1], row[0]))
+    return [ProductState(*row[:-1]) for row in rows]
+
+def update_crawl_state(cursor, states, prices, policy, now, worker_id):
+    """Schedule the next crawl of every product in ``states`` and release their leases.
+
+    ``prices`` maps product ids to the parsed price, products missing from it
+    or parsed without a price count as failed crawls. Only products still
+    leased to ``worker_id`` are updated: after an expired lease another
+    worker may own the product, its state is left alone. Returns the number
+    of products skipped that way.
+    """
+    rows = list()
+    for state in states:
+        price = prices.get(state.product_id)
+        if price is None or price != price:
+            failure_count = state.failure_count + 1
+            next_due_at = now + timedelta(hours=policy.get_failure_delay(failure_count))
+            rows.append((state.product_id, next_due_at, now, state.last_price, state.change_rate, failure_count, None, None))
+            continue
+        changed = state.last_price is not None and abs(float(state.last_price) - price) > PRICE_TOLERANCE
+        change_rate = (1 - CHANGE_RATE_WEIGHT) * state.change_rate + CHANGE_RATE_WEIGHT * (1.0 if changed else 0.0)
+        next_due_at = now + timedelta(hours=policy.get_interval(change_rate, state.subscribers))
+        rows.append((state.product_id, next_due_at, now, price, change_rate, 0, None, None))
+    lease_held = sql.SQL("product_crawl_state.lease_owner = {}").format(sql.Literal(worker_id))
+    updated = upsert_rows(cursor, 'product_crawl_state', STATE_COLUMNS, rows, conflict_columns=['product_id'], update_condition=lease_held)
+    skipped = len(rows) - updated
+    if skipped:
+        logger.warning("Lease of %s product(s) expired and passed to another worker, their crawl state was not updated", skipped)
+    return skipped
@@ -8,43 +8,54 @@ import logging
 # Add parent directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from web_parsing.parse_products import job
-from web_parsing.price_prediction import batch_main as predict_prices
-
-# Configure logging to console only
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from web_parsing.parse_products import job, DEFAULT_TICK_MINUTES
+from web_parsing.price_prediction import DEFAULT_FULL_REBUILD_TIME, batch_main as predict_prices
+from web_parsing.tracing import configure_logging
+
 logger = logging.getLogger(__name__)
 
-def run_tasks():
-    """Run both parsing and prediction tasks in sequence"""
+def run_crawl():
+    """Crawl the products that are due, see recrawl_scheduler"""
     try:
         logger.info("Starting product parsing...")
         job()
         logger.info("Product parsing completed successfully")
-        
+    except Exception as e:
+        logger.error(f"Error in product parsing: {str(e)}")
+
+def run_predictions(mode=None):
+    try:
         logger.info("Starting price prediction...")
-        predict_prices()
+        predict_prices(mode=mode)
         logger.info("Price prediction completed successfully")
     except Exception as e:
-        logger.error(f"Error in scheduled tasks: {str(e)}")
+        logger.error(f"Error in price prediction: {str(e)}")
+
+def run_tasks():
+    """Run both parsing and prediction tasks in sequence"""
+    run_crawl()
+    run_predictions()
 
 def main():
     """Main function to schedule and run tasks"""
-    try:
-        job()
-    except Exception as e:
-        print(f"[{datetime.now()}] Error: {e}")
+    tick_minutes = int(os.getenv('RECRAWL_TICK_MINUTES', DEFAULT_TICK_MINUTES))
+    full_rebuild_time = os.getenv('PREDICTION_FULL_REBUILD_TIME', DEFAULT_FULL_REBUILD_TIME)
 
-    # Schedule tasks to run every 6 hours
-    schedule.every(6).hours.do(run_tasks)
+    # Every product has its own next crawl time, the crawl only picks up
+    # the due ones, so it is triggered often.
+    schedule.every(tick_minutes).minutes.do(run_crawl)
+    # Predictions are refreshed every 6 hours
+    schedule.every(6).hours.do(run_predictions)
+    # The runs in between fold new observations into the model states, with
+    # an approximate outlier filter (see model_state.filter_new_prices). The
+    # nightly one rebuilds every state exactly, from the history as it is after retention
+    schedule.every().day.at(full_rebuild_time).do(run_predictions, mode='full')
     
     # Run immediately on startup
     run_tasks()
     
-    logger.info("Scheduler started. Tasks will run every 6 hours.")
+    logger.info(f"Scheduler started. Due products are crawled every {tick_minutes} minutes, predictions run every 6 hours, "
+                f"model states are rebuilt daily at {full_rebuild_time}.")
     
     # Keep the script running
     while True:
@@ -52,4 +63,5 @@ def main():
         time.sleep(50)  # Check every 50 seconds
 
 if __name__ == "__main__":
+    configure_logging()
     main() 
\ No newline at end of file
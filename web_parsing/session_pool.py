@@ -0,0 +1,71 @@
+import os
+import threading
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+
+class SessionPool:
+    """Keep-alive HTTP sessions keyed by marketplace key.
+
+    Blocking ``requests`` sessions live as long as the pool. aiohttp sessions
+    are bound to the event loop that created them, so they have to be closed
+    with ``close_async`` before that loop finishes.
+    """
+
+    def __init__(self, headers, pool_connections=None, pool_maxsize=None, dns_cache_ttl=None, keepalive_timeout=None):
+        self.headers = headers
+        self.pool_connections = pool_connections or int(os.getenv('HTTP_POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS))
+        self.pool_maxsize = pool_maxsize or int(os.getenv('HTTP_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE))
+        self.dns_cache_ttl = dns_cache_ttl or int(os.getenv('HTTP_DNS_CACHE_TTL', DEFAULT_DNS_CACHE_TTL))
+        self.keepalive_timeout = keepalive_timeout or int(os.getenv('HTTP_KEEPALIVE_TIMEOUT', DEFAULT_KEEPALIVE_TIMEOUT))
+        self.__sessions = dict()
+        self.__async_sessions = dict()
+        self.__lock = threading.Lock()
+
+    def get_session(self, marketplace_key):
+        with self.__lock:
+            session = self.__sessions.get(marketplace_key)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.__sessions[marketplace_key] = session
+            return session
+
+    def get_async_session(self, marketplace_key, timeout=None):
+        """Must be called from inside the event loop that will use the session"""
+        session = self.__async_sessions.get(marketplace_key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_maxsize,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            )
+            self.__async_sessions[marketplace_key] = session
+        return session
+
+    async def close_async(self):
+        sessions = list(self.__async_sessions.values())
+        self.__async_sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    def close(self):
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions.clear()
+        for session in sessions:
+            session.close()
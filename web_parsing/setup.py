@@ -7,13 +7,15 @@ setup(
     install_requires=[
         "requests",
         "beautifulsoup4",
+        "soupsieve",
         "pandas",
         "sqlalchemy",
         "psycopg2-binary",
         "validators",
-        "lxml"
+        "lxml",
+        "aiohttp"
     ],
     package_data={
-        "web_parsing": ["configuration/*.json"],
+        "web_parsing": ["configuration/*.json", "migrations/*.sql"],
     },
 ) 
\ No newline at end of file
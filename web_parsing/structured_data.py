@@ -0,0 +1,147 @@
+import html
+import json
+import re
+
+JSON_LD_PATTERN = re.compile(
+    r'<script[^>]*type\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>',
+    re.IGNORECASE | re.DOTALL
+)
+META_TAG_PATTERN = re.compile(r'<meta\s[^>]*>', re.IGNORECASE)
+ITEMPROP_TAG_PATTERN = re.compile(r'<[a-z][a-z0-9]*\s[^>]*\bitemprop\s*=[^>]*>', re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r'([a-z_:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))', re.IGNORECASE)
+HEAD_END_PATTERN = re.compile(r'</head\s*>', re.IGNORECASE)
+
+OPENGRAPH_PROPERTIES = {
+    'og:title': 'name',
+    'product:price:amount': 'price',
+    'og:price:amount': 'price',
+    'product:price:currency': 'currency',
+    'og:price:currency': 'currency',
+}
+ITEMPROP_PROPERTIES = {
+    'price': 'price',
+    'lowprice': 'price',
+    'pricecurrency': 'currency',
+}
+
+class StructuredData:
+    """Product values found in page metadata, any of them may be None"""
+
+    def __init__(self, name=None, price=None, currency=None):
+        self.name = name
+        self.price = price
+        self.currency = currency
+
+    def is_complete(self):
+        return self.name is not None and self.price is not None and self.currency is not None
+
+    def update_missing(self, values):
+        """Fill the missing name, and the price with its currency only as a pair from the same source"""
+        if self.name is None and not is_empty(values.get('name')):
+            self.name = values['name']
+        if self.price is None and not is_empty(values.get('price')) and not is_empty(values.get('currency')):
+            self.price = values['price']
+            self.currency = values['currency']
+
+def is_empty(value):
+    return value is None or value == ''
+
+def decode_content(content, encoding=None):
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode(encoding or 'utf-8', errors='replace')
+    except LookupError:
+        return content.decode('utf-8', errors='replace')
+
+def parse_attributes(tag):
+    attributes = dict()
+    for match in ATTRIBUTE_PATTERN.finditer(tag):
+        value = next(group for group in match.groups()[1:] if group is not None)
+        attributes[match.group(1).lower()] = html.unescape(value)
+    return attributes
+
+def has_type(node, type_name):
+    node_type = node.get('@type')
+    if isinstance(node_type, list):
+        return type_name in node_type
+    return node_type == type_name
+
+def iterate_json_ld_nodes(node):
+    """Every dict of a JSON-LD document, including the ones nested in @graph and lists"""
+    if isinstance(node, list):
+        for item in node:
+            yield from iterate_json_ld_nodes(item)
+    elif isinstance(node, dict):
+        yield node
+        for value in node.values():
+            if isinstance(value, (list, dict)):
+                yield from iterate_json_ld_nodes(value)
+
+def get_offer_values(offers):
+    if isinstance(offers, list):
+        for offer in offers:
+            values = get_offer_values(offer)
+            if values['price'] is not None:
+                return values
+        return {'price': None, 'currency': None}
+    if not isinstance(offers, dict):
+        return {'price': None, 'currency': None}
+    price = offers.get('price')
+    if price is None:
+        price = offers.get('lowPrice')
+    if price is None and isinstance(offers.get('priceSpecification'), dict):
+        price = offers['priceSpecification'].get('price')
+    return {'price': price, 'currency': offers.get('priceCurrency')}
+
+def extract_json_ld(text):
+    for match in JSON_LD_PATTERN.finditer(text):
+        try:
+            document = json.loads(match.group(1).strip())
+        except ValueError:
+            continue
+        for node in iterate_json_ld_nodes(document):
+            if not has_type(node, 'Product'):
+                continue
+            values = get_offer_values(node.get('offers'))
+            name = node.get('name')
+            values['name'] = html.unescape(name) if isinstance(name, str) else None
+            return values
+    return dict()
+
+def extract_opengraph(text):
+    head_end = HEAD_END_PATTERN.search(text)
+    head = text[:head_end.start()] if head_end else text
+    values = dict()
+    for match in META_TAG_PATTERN.finditer(head):
+        attributes = parse_attributes(match.group())
+        attribute = OPENGRAPH_PROPERTIES.get(attributes.get('property', '').lower())
+        if attribute is not None and attribute not in values and attributes.get('content'):
+            values[attribute] = attributes['content']
+    return values
+
+def extract_itemprops(text):
+    values = dict()
+    for match in ITEMPROP_TAG_PATTERN.finditer(text):
+        attributes = parse_attributes(match.group())
+        attribute = ITEMPROP_PROPERTIES.get(attributes.get('itemprop', '').lower())
+        if attribute is not None and attribute not in values and attributes.get('content'):
+            values[attribute] = attributes['content']
+    return values
+
+def extract_structured_data(content, encoding=None):
+    """Name, price and currency from JSON-LD Product/Offer, OpenGraph and itemprop metadata.
+
+    The page is scanned with regular expressions instead of being parsed into
+    a tree. Sources are tried from the most to the least specific and later
+    ones only fill values the earlier ones did not provide. A price is
+    only taken together with the currency of the same source, a source
+    with just one of them is skipped for both.
+    """
+    text = decode_content(content, encoding)
+    data = StructuredData()
+    for extract in (extract_json_ld, extract_opengraph, extract_itemprops):
+        data.update_missing(extract(text))
+        if data.is_complete():
+            break
+    return data
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import random
+import sys
+import uuid
+
+DEFAULT_LOG_LEVEL = 'INFO'
+DEFAULT_LOG_FORMAT = 'text'
+DEFAULT_TRACE_SAMPLE_RATE = 0.0
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Attributes every LogRecord has, anything else was passed through ``extra``
+RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, fields passed through ``extra`` become keys"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def configure_logging(level=None, log_format=None):
+    """Send logs to stdout, LOG_LEVEL and LOG_FORMAT (text or json) by default.
+
+    Only entry points call this, importing a module never configures logging.
+    """
+    level = (level or os.getenv('LOG_LEVEL', DEFAULT_LOG_LEVEL)).upper()
+    log_format = (log_format or os.getenv('LOG_FORMAT', DEFAULT_LOG_FORMAT)).lower()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+
+def get_trace_sample_rate():
+    return float(os.getenv('TRACE_SAMPLE_RATE', DEFAULT_TRACE_SAMPLE_RATE))
+
+class Trace:
+    """Debug events of a single URL, logged lazily with the trace id and url attached"""
+
+    def __init__(self, logger, url):
+        self.logger = logger
+        self.url = url
+        self.trace_id = uuid.uuid4().hex[:12]
+
+    def __bool__(self):
+        return True
+
+    def event(self, message, *args):
+        self.logger.debug(
+            "[trace %s] %s: " + message, self.trace_id, self.url, *args,
+            extra={'trace_id': self.trace_id, 'url': self.url}
+        )
+
+class DisabledTrace:
+    """Stand-in for URLs that were not sampled, falsy so callers can skip building arguments"""
+
+    def __bool__(self):
+        return False
+
+    def event(self, message, *args):
+        pass
+
+DISABLED_TRACE = DisabledTrace()
+
+def start_trace(logger, url, sample_rate=None):
+    """Trace of ``url`` for a TRACE_SAMPLE_RATE share of calls while ``logger`` has DEBUG enabled"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return DISABLED_TRACE
+    if sample_rate is None:
+        sample_rate = get_trace_sample_rate()
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return DISABLED_TRACE
+    return Trace(logger, url)